@@ -0,0 +1,31 @@
+"""
+Measures the start-up time of the component: the import of the component module in a fresh interpreter.
+
+Usage: python scripts/benchmark_startup.py [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+
+def measure_import(runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import component'], cwd=SRC_PATH, check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name, timings):
+    print(f"{name:<40} median {statistics.median(timings) * 1000:8.2f} ms, "
+          f"min {min(timings) * 1000:8.2f} ms ({len(timings)} runs)")
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    report('import component (fresh interpreter)', measure_import(runs))
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import logging
+import sqlite3
+
+HASH_DIGEST_SIZE = 16
+
+
+class ChangeIndex:
+    """
+    Persistent index of the output rows, maps the primary key of every row of a table to the hash of the row.
+
+    Only rows which are new or changed since the previous run pass the filter, rows of the fully fetched tables
+    which were not seen in the run can be listed as deleted.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS row_hashes (
+                table_name TEXT NOT NULL,
+                row_key TEXT NOT NULL,
+                row_hash BLOB NOT NULL,
+                run_id INTEGER NOT NULL,
+                PRIMARY KEY (table_name, row_key)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS table_keys (
+                table_name TEXT PRIMARY KEY,
+                primary_key TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT
+            );
+        """)
+        self.run_id = self.connection.execute('INSERT INTO runs DEFAULT VALUES').lastrowid
+        self.touched_tables = set()
+        self.partial_tables = set()
+        self.changed_rows = 0
+        self.unchanged_rows = 0
+
+    def touch(self, table):
+        self.touched_tables.add(table)
+
+    def mark_partial(self, tables):
+        """
+        Tables which were not fully fetched in this run, rows missing in them are not deletions
+        """
+        self.partial_tables.update(tables)
+
+    def filter_changed(self, table, primary_key, rows):
+        """
+        Returns only new and changed rows, the index is updated with all of them
+        """
+        self.connection.execute('INSERT OR REPLACE INTO table_keys VALUES (?, ?)', (table, json.dumps(primary_key)))
+
+        changed = []
+        for row in rows:
+            row_key = self._row_key(row, primary_key)
+            row_hash = hashlib.blake2b(json.dumps(row, sort_keys=True, default=str).encode('utf-8'),
+                                       digest_size=HASH_DIGEST_SIZE).digest()
+            stored = self.connection.execute('SELECT row_hash FROM row_hashes WHERE table_name = ? AND row_key = ?',
+                                             (table, row_key)).fetchone()
+            if stored and stored[0] == row_hash:
+                self.connection.execute('UPDATE row_hashes SET run_id = ? WHERE table_name = ? AND row_key = ?',
+                                        (self.run_id, table, row_key))
+                self.unchanged_rows += 1
+                continue
+
+            self.connection.execute('INSERT OR REPLACE INTO row_hashes VALUES (?, ?, ?, ?)',
+                                    (table, row_key, row_hash, self.run_id))
+            changed.append(row)
+        self.changed_rows += len(changed)
+        return changed
+
+    def pop_deleted(self):
+        """
+        Yields the table, its primary key and the primary key values of rows of the fully fetched tables
+        not seen in this run, the rows are removed from the index
+        """
+        for table in sorted(self.touched_tables - self.partial_tables):
+            primary_key = self.connection.execute('SELECT primary_key FROM table_keys WHERE table_name = ?',
+                                                  (table,)).fetchone()
+            primary_key = json.loads(primary_key[0]) if primary_key else None
+            if not primary_key:
+                continue
+            deleted = [dict(zip(primary_key, json.loads(row_key))) for row_key, in self.connection.execute(
+                'SELECT row_key FROM row_hashes WHERE table_name = ? AND run_id != ?', (table, self.run_id))]
+            if deleted:
+                self.connection.execute('DELETE FROM row_hashes WHERE table_name = ? AND run_id != ?',
+                                        (table, self.run_id))
+                yield table, primary_key, deleted
+
+    def close(self):
+        logging.info(f"Change index: {self.changed_rows} new or changed rows written, "
+                     f"{self.unchanged_rows} unchanged rows skipped")
+        self.connection.commit()
+        self.connection.close()
+
+    @staticmethod
+    def _row_key(row, primary_key):
+        if not primary_key:
+            return json.dumps(row, sort_keys=True, default=str)
+        return json.dumps([str(row.get(column)) for column in primary_key])
@@ -1,14 +1,23 @@
 import asyncio
+import collections
+import datetime
 import json
 import logging
 import os
 import time
 import random
 
-from httpx import HTTPStatusError
+from httpx import HTTPStatusError, TransportError
 from keboola.http_client.async_client import AsyncHttpClient
 
+from .change_index import ChangeIndex
+from .http_archive import HttpArchive
 from .mapping_parser import MappingParser
+from .mapping_selection import mapping_opt_fields, select_mappings
+from .resource_governor import ResourceGovernor
+from .scheduling import estimate_makespan, order_largest_first
+from .segment_store import SegmentStore
+from .token_pool import TokenPool
 
 MAPPINGS_JSON = 'endpoint_mappings.json'
 
@@ -79,6 +88,8 @@ REQUEST_MAP = {
 
 DEFAULT_MAX_REQUESTS_PER_SECOND = 2
 DEFAULT_BATCH_SIZE = 100
+# Maximum number of pages buffered by every level of iter_records
+DEFAULT_STREAM_BUFFER_SIZE = 10
 
 # The number of objects to return per page. The value must be between 1 and 100.
 API_PAGE_LIMIT = 100
@@ -86,8 +97,41 @@ API_PAGE_LIMIT = 100
 KEY_FORBIDDEN_ENDPOINTS = 'forbidden_endpoints'
 KEY_GID = 'gid'
 KEY_GEN_ID = 'gen_id'
+KEY_MEMBERSHIPS = 'memberships'
+KEY_WORKSPACE_GID = 'workspace_gid'
+KEY_CREATED_AT = 'created_at'
+KEY_MODIFIED_AT = 'modified_at'
+KEY_UNCHANGED = 'unchanged'
+KEY_WATERMARK_ENDPOINTS = 'endpoints'
 TMP_FOLDER_PATH = '/tmp'
 
+RETRY_STATUS_CODES = [400, 402, 429, 500, 502, 503, 504]
+REQUEST_RETRIES = 3
+# Statuses on which a pooled request is repeated with another token
+TOKEN_THROTTLED_STATUS = 429
+TOKEN_FORBIDDEN_STATUSES = {401, 403}
+
+# Fields requested on the project task listing when section tasks are derived from task memberships
+SECTION_TASKS_OPT_FIELDS = 'name,resource_type,memberships.section,memberships.project'
+
+# Fields used by the client itself, requested even when the mapping does not use them
+PARENT_REQUIRED_FIELDS = {
+    'workspaces': ['name'],
+    'projects_details': ['workspace', 'created_at', 'modified_at']
+}
+
+# Listings which can be split into created_at windows of the workspace task search for oversized parents
+SPLITTABLE_ENDPOINTS = {'projects_tasks': 'workspaces/{workspace_id}/tasks/search'}
+SPLIT_OPT_FIELDS = 'name,resource_type,resource_subtype,created_at,completed,completed_at'
+DEFAULT_SPLIT_WINDOWS = 8
+# Adjacent windows overlap so that tasks created exactly on a window boundary are not lost, duplicates are removed
+SPLIT_WINDOW_OVERLAP = datetime.timedelta(seconds=1)
+SPLIT_CURSOR_OVERLAP = datetime.timedelta(milliseconds=1)
+# HTTP archive metadata with the end of the split windows, replayed splits request the same windows
+KEY_SPLIT_REFERENCE_TIME = 'split_reference_time'
+# HTTP archive metadata with the completed_since filter, replayed runs use the recorded one
+KEY_COMPLETED_SINCE = 'completed_since'
+
 
 class AsanaClientException(Exception):
     def __init__(self, message, status_code=None):
@@ -99,7 +143,13 @@ class AsanaClientException(Exception):
 class AsanaClient(AsyncHttpClient):
     def __init__(self, destination, api_token, incremental=False, debug: bool = False, skip_unauthorized: bool = False,
                  max_requests_per_second: int = DEFAULT_MAX_REQUESTS_PER_SECOND, membership_timestamp: bool = False,
-                 batch_size: int = DEFAULT_BATCH_SIZE):
+                 batch_size: int = DEFAULT_BATCH_SIZE, section_tasks_from_memberships: bool = False,
+                 split_page_threshold: int = 0, split_windows: int = DEFAULT_SPLIT_WINDOWS,
+                 parent_stats: dict = None, tmp_path: str = TMP_FOLDER_PATH, max_memory_mb: int = None,
+                 max_tmp_disk_mb: int = None, additional_tokens: list = None, change_index_path: str = None,
+                 output_deletions: bool = False, skip_unchanged_projects: bool = False,
+                 project_watermarks: dict = None, http_archive_path: str = None, http_archive_mode: str = None,
+                 replay_latency_ms: float = 0, column_selection: dict = None, skip_tables: list = None):
         self.request_map_levels = None
         self.tables_out_path = destination
         self.incremental = incremental
@@ -112,38 +162,218 @@ class AsanaClient(AsyncHttpClient):
         self.endpoints_needed = set()
         self.completed_since = None
         self.batch_size = batch_size
+        self.tmp_store = SegmentStore(tmp_path)
+        self.governor = ResourceGovernor(max_memory_mb=max_memory_mb, max_tmp_disk_mb=max_tmp_disk_mb)
+        self.change_index = ChangeIndex(change_index_path) if change_index_path else None
+        self.output_deletions = output_deletions
+        self.fetched_endpoints = []
+        self.partial_endpoints = set()
+        self.skip_unchanged_projects = skip_unchanged_projects
+        self.previous_project_watermarks = project_watermarks or {}
+        self.project_watermarks = {}
+        self.prune_unchanged_projects = False
+        self.http_archive = HttpArchive(http_archive_path, http_archive_mode, replay_latency_ms) \
+            if http_archive_path else None
+        self.section_tasks_from_memberships = section_tasks_from_memberships
+        self.derive_section_tasks = False
+        self.split_page_threshold = split_page_threshold
+        self.split_windows = split_windows
+        # Window requests of all split parents share this limit on top of the batch_size parents fetched at once
+        self.split_slots = None
+        self.split_reference_time = None
+        # Request and page counts of parents, the counts of the previous run are kept for parents not fetched now
+        self.previous_parent_stats = parent_stats or {}
+        self.parent_stats = {endpoint: dict(stats) for endpoint, stats in self.previous_parent_stats.items()}
+
+        # With more tokens every token has its own rate limit, throttled tokens are replaced instead of retried
+        self.token_pool = None
+        if additional_tokens:
+            self.token_pool = TokenPool([api_token] + list(additional_tokens), max_requests_per_second)
+            logging.info(f"Spreading requests across {len(self.token_pool)} tokens")
+        # Pooled requests are retried by _get_pooled so that every attempt goes through a token rate limiter
         super().__init__(base_url=BASE_URL,
-                         auth=(api_token, ''),
-                         retries=3,
-                         retry_status_codes=[400, 402, 429, 500, 502, 503, 504],
-                         max_requests_per_second=max_requests_per_second,
+                         auth=None if self.token_pool else (api_token, ''),
+                         retries=0 if self.token_pool else REQUEST_RETRIES,
+                         retry_status_codes=[code for code in RETRY_STATUS_CODES
+                                             if not self.token_pool or code != TOKEN_THROTTLED_STATUS],
+                         max_requests_per_second=None if self.token_pool else max_requests_per_second,
                          timeout=10,
                          debug=debug)
 
         self._init_mappings()
-        self._init_tmp_folders()
+        self.endpoint_opt_fields = {}
+        if column_selection or skip_tables:
+            self._init_mapping_selection(column_selection or {}, skip_tables or [])
 
     def _init_mappings(self):
         json_path = os.path.join(os.path.dirname(__file__), MAPPINGS_JSON)
         with open(json_path, 'r') as m:
             self.mappings = json.load(m)
 
+    def _init_mapping_selection(self, column_selection, skip_tables):
+        """
+        Removes not selected columns and child tables from the mappings, endpoints whose tables are affected
+        request only the fields used by their mapping
+        """
+        selected_tables = set(column_selection) | set(skip_tables)
+        affected_mappings = {mapping_name for mapping_name, mapping in self.mappings.items()
+                             if selected_tables.intersection(self._mapping_tables(mapping, mapping_name))}
+        self.mappings = select_mappings(self.mappings, column_selection, skip_tables)
+
+        for endpoint, details in self.request_map.items():
+            if details['mapping'] in affected_mappings:
+                self.endpoint_opt_fields[endpoint] = (mapping_opt_fields(self.mappings[details['mapping']])
+                                                      + PARENT_REQUIRED_FIELDS.get(endpoint, []))
+
     async def fetch(self, endpoints, completed_since=None):
 
+        # The tmp folder is used only by fetch, iter_records streams without it
+        self._init_tmp_folders()
         self.endpoints_needed = self.get_endpoints_needed(endpoints)
+        self.derive_section_tasks = self._should_derive_section_tasks()
+        if self.derive_section_tasks:
+            logging.info("Section tasks will be derived from project task memberships")
+            self.endpoints_needed.discard('projects_sections_tasks')
+            self.fetched_endpoints.append('projects_sections_tasks')
+        self.prune_unchanged_projects = self._can_prune_unchanged_projects()
         self.request_map_levels = self.construct_request_map_with_levels()
         self.requested_endpoints = endpoints
-        self.completed_since = completed_since
+        self.completed_since = self._get_archived_completed_since(completed_since)
 
-        for level in self.request_map_levels:
-            tasks = []
-            logging.debug(f"Fetching level: {level}")
-            level_endpoints = self.request_map_levels[level]
-            for level_endpoint in level_endpoints:
-                if level_endpoint in self.endpoints_needed:
-                    tasks.append(self._fetch(level_endpoint, completed_since=self.completed_since))
+        try:
+            for level in self.request_map_levels:
+                tasks = []
+                logging.debug(f"Fetching level: {level}")
+                level_endpoints = self.request_map_levels[level]
+                for level_endpoint in level_endpoints:
+                    if level_endpoint in self.endpoints_needed:
+                        tasks.append(self._fetch(level_endpoint, completed_since=self.completed_since))
+
+                await asyncio.gather(*tasks)
+        finally:
+            # the archive recorded so far stays readable when the fetching fails
+            if self.http_archive:
+                self.http_archive.close()
+
+        self.governor.log_report()
+        if self.change_index:
+            self._finalize_change_index()
+
+    async def iter_records(self, endpoint, raw=False, completed_since=None,
+                           buffer_size=DEFAULT_STREAM_BUFFER_SIZE):
+        """
+        Streams records of the endpoint as pages arrive, parent endpoints are requested as in fetch
+        but nothing is written to the tmp folder or the output tables.
 
-            await asyncio.gather(*tasks)
+        Yields raw API objects when raw is set, (table, row) tuples of the mapped output tables otherwise.
+        At most buffer_size pages are buffered on every level, fetching waits for the consumer.
+        """
+        mapping_name = self.request_map[self._prepare_request_params(endpoint)[0]]['mapping']
+        completed_since = self._get_archived_completed_since(completed_since)
+        async for parent_id, page in self._stream_pages(endpoint, completed_since, buffer_size):
+            if raw:
+                for record in page:
+                    yield record
+                continue
+
+            rows = []
+            MappingParser(
+                destination=self.tables_out_path,
+                endpoint=mapping_name,
+                endpoint_data=page,
+                mapping=self.mappings[mapping_name],
+                parent_key=parent_id,
+                incremental=self.incremental,
+                add_timestamp=self.membership_timestamp,
+                output_rows=rows
+            )
+            for row in rows:
+                yield row
+
+    async def _stream_pages(self, endpoint, completed_since, buffer_size):
+        """
+        Yields (parent id, page data) of the endpoint, parents are streamed from the required endpoint
+        and up to batch_size of them are requested at once
+        """
+        endpoint, request_params = self._prepare_request_params(endpoint, completed_since)
+        endpoint_url = self.request_map[endpoint]['endpoint']
+        required_endpoint = self.request_map[endpoint].get('required')
+
+        if not required_endpoint:
+            root_id = await self._generate_root_id()
+            async for page in self._iter_pages(endpoint_url, request_params):
+                yield root_id, page
+            return
+
+        queue = asyncio.Queue(maxsize=buffer_size)
+        done = object()
+
+        async def fetch_parent(parent_id, semaphore):
+            try:
+                parent_url = endpoint_url.replace('{' + f'{required_endpoint}' + '_id}', parent_id)
+                async for page in self._iter_pages(parent_url, request_params):
+                    await queue.put((parent_id, page))
+            finally:
+                semaphore.release()
+
+        async def produce():
+            semaphore = asyncio.Semaphore(self.batch_size)
+            parent_tasks = []
+            try:
+                async for parent in self._stream_parents(required_endpoint, completed_since, buffer_size):
+                    if endpoint in parent.get(KEY_FORBIDDEN_ENDPOINTS, []):
+                        continue
+                    await semaphore.acquire()
+                    parent_tasks.append(asyncio.create_task(fetch_parent(parent[KEY_GID], semaphore)))
+                await asyncio.gather(*parent_tasks)
+                await queue.put(done)
+            except Exception as e:
+                await queue.put(e)
+            finally:
+                for task in parent_tasks:
+                    task.cancel()
+
+        producer = asyncio.create_task(produce())
+        try:
+            while (item := await queue.get()) is not done:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            producer.cancel()
+
+    async def _stream_parents(self, endpoint, completed_since, buffer_size):
+        # Parents added manually are used as they are
+        if self.root_endpoints_data[endpoint]:
+            for parent in self.root_endpoints_data[endpoint]:
+                yield parent
+            return
+
+        async for _, page in self._stream_pages(endpoint, completed_since, buffer_size):
+            for record in page:
+                yield self._check_endpoint_rules(endpoint, record)
+
+    async def _iter_pages(self, endpoint_url, params=None):
+        """
+        Yields data of every page of the listing
+        """
+        params = dict(params) if params else {}
+        params['limit'] = API_PAGE_LIMIT
+        while True:
+            try:
+                r = await self._get(endpoint=endpoint_url, params=params)
+            except AsanaClientException as e:
+                if e.status_code == 403 and self.skip_unauthorized:
+                    logging.warning(f"Skipping unauthorized request: {e}")
+                    return
+                raise
+
+            data = r.get('data', [])
+            yield [data] if isinstance(data, dict) else data
+
+            if not r.get('next_page'):
+                return
+            params['offset'] = r['next_page']['offset']
 
     async def _fetch(self, fetched_endpoint, completed_since=None):
         """
@@ -152,7 +382,28 @@ class AsanaClient(AsyncHttpClient):
 
         logging.info(f'Requesting {fetched_endpoint}...')
 
-        # Prep-ing request parameters
+        fetched_endpoint, request_params = self._prepare_request_params(fetched_endpoint, completed_since)
+        self.fetched_endpoints.append(fetched_endpoint)
+        if 'completed_since' in request_params:
+            self.partial_endpoints.add(fetched_endpoint)
+
+        # Inputs required for the parser and requests
+        required_endpoint_data = self.request_map[fetched_endpoint].get('required')
+
+        # For endpoints required data from parent endpoint
+        if required_endpoint_data:
+            await self._get_multiple_batched(fetched_endpoint, request_params, required_endpoint_data)
+
+        else:
+            endpoint_url = self.request_map[fetched_endpoint]['endpoint']
+            await self._get_request(endpoint_url=endpoint_url, endpoint_id=await self._generate_root_id(),
+                                    endpoint=fetched_endpoint)
+        await self._drain_endpoint_tmp(fetched_endpoint)
+
+    def _prepare_request_params(self, fetched_endpoint, completed_since=None):
+        """
+        Returns the endpoint to be requested and its request parameters
+        """
         request_params = {}
         if fetched_endpoint == 'archived_projects':
             fetched_endpoint = 'projects'
@@ -167,23 +418,24 @@ class AsanaClient(AsyncHttpClient):
         if fetched_endpoint == "projects_tasks":
             if self.incremental and completed_since:
                 request_params['completed_since'] = completed_since
+            if self.derive_section_tasks:
+                request_params['opt_fields'] = SECTION_TASKS_OPT_FIELDS
 
-        # Inputs required for the parser and requests
-        required_endpoint_data = self.request_map[fetched_endpoint].get('required')
+        # Only fields used by the selected columns are requested
+        if fetched_endpoint in self.endpoint_opt_fields:
+            opt_fields = request_params.get('opt_fields', '').split(',') + self.endpoint_opt_fields[fetched_endpoint]
+            request_params['opt_fields'] = ','.join(dict.fromkeys(field for field in opt_fields if field))
 
-        # For endpoints required data from parent endpoint
-        if required_endpoint_data:
-            await self._get_multiple_batched(fetched_endpoint, request_params, required_endpoint_data)
-
-        else:
-            endpoint_url = self.request_map[fetched_endpoint]['endpoint']
-            await self._get_request(endpoint_url=endpoint_url, endpoint_id=await self._generate_root_id(),
-                                    endpoint=fetched_endpoint)
-        await self._parse_endpoint_data_from_tmp(fetched_endpoint)
+        return fetched_endpoint, request_params
 
-    def _generate_batch(self, data):
-        for i in range(0, len(data), self.batch_size):
-            yield data[i:i + self.batch_size]
+    def _should_derive_section_tasks(self):
+        """
+        Section tasks can be derived from the project task listing only when both endpoints are fetched,
+        otherwise the separate sections/{id}/tasks pass is kept
+        """
+        return (self.section_tasks_from_memberships
+                and 'projects_sections_tasks' in self.endpoints_needed
+                and 'projects_tasks' in self.endpoints_needed)
 
     async def _get_multiple_batched(self, fetched_endpoint, request_params, required_endpoint_data):
 
@@ -191,16 +443,79 @@ class AsanaClient(AsyncHttpClient):
         without_forbidden_endpoints = [endpoint for endpoint in self.root_endpoints_data[required_endpoint_data] if
                                        fetched_endpoint not in endpoint.get(KEY_FORBIDDEN_ENDPOINTS, [])]
 
-        for batch_parent_endpoint_data in self._generate_batch(without_forbidden_endpoints):
-            tasks = []
-            for parent_endpoint_data in batch_parent_endpoint_data:
-                parent_id = parent_endpoint_data[KEY_GID]
-                endpoint_url = self.request_map[fetched_endpoint]['endpoint']
-                endpoint_url = endpoint_url.replace('{' + f'{required_endpoint_data}' + '_id}', parent_id)
+        # Subtrees of projects not modified since the previous run are not fetched
+        if required_endpoint_data == 'projects_details':
+            unchanged = [parent for parent in without_forbidden_endpoints if parent.get(KEY_UNCHANGED)]
+            if unchanged:
+                logging.info(f"Skipping {fetched_endpoint} of {len(unchanged)} projects not modified since last run")
+                self.partial_endpoints.add(fetched_endpoint)
+                without_forbidden_endpoints = [parent for parent in without_forbidden_endpoints
+                                               if not parent.get(KEY_UNCHANGED)]
+
+        # Stats of parents which no longer exist are not kept in the state
+        existing_parents = {parent[KEY_GID] for parent in self.root_endpoints_data[required_endpoint_data]}
+        for parent_id in set(self.parent_stats.get(fetched_endpoint, {})) - existing_parents:
+            del self.parent_stats[fetched_endpoint][parent_id]
+
+        scheduled = self._schedule_parents(fetched_endpoint, without_forbidden_endpoints)
+        parents = collections.deque(scheduled)
+        start = time.monotonic()
+
+        # Up to batch_size parents are fetched at once (fewer on memory pressure),
+        # a worker takes the next parent as soon as it is done
+        async def fetch_parents():
+            while parents:
+                async with self.governor.fetch_slot(fetched_endpoint, self.batch_size):
+                    if not parents:
+                        break
+                    parent_endpoint_data = parents.popleft()
+                    parent_id = parent_endpoint_data[KEY_GID]
+                    endpoint_url = self.request_map[fetched_endpoint]['endpoint']
+                    endpoint_url = endpoint_url.replace('{' + f'{required_endpoint_data}' + '_id}', parent_id)
+
+                    await self._get_request(endpoint_url=endpoint_url, params=request_params, endpoint_id=parent_id,
+                                            endpoint=fetched_endpoint, parent_data=parent_endpoint_data)
+
+                # New parents are not fetched until the data fetched so far fit the resource budgets
+                await self.governor.throttle(self.tmp_store.size(), self.batch_size,
+                                             drain=lambda: self._drain_endpoint_tmp(fetched_endpoint))
 
-                tasks.append(self._get_request(endpoint_url=endpoint_url, params=request_params, endpoint_id=parent_id,
-                                               endpoint=fetched_endpoint))
-            await asyncio.gather(*tasks)
+        await asyncio.gather(*[fetch_parents() for _ in range(min(self.batch_size, len(parents)))])
+        self._log_schedule_report(fetched_endpoint, without_forbidden_endpoints, scheduled, time.monotonic() - start)
+
+    @staticmethod
+    def _parent_pages(endpoint, parents, stats):
+        """
+        Pages of every parent, parents without stats had a single page as only larger parents are stored
+        """
+        stats = stats.get(endpoint, {})
+        return [stats[parent[KEY_GID]][1] if parent[KEY_GID] in stats else 1 for parent in parents]
+
+    def _schedule_parents(self, endpoint, parents):
+        """
+        Orders parents largest first by their page counts from the previous run,
+        parents without stats keep their order after them
+        """
+        pages = self._parent_pages(endpoint, parents, self.previous_parent_stats)
+        return order_largest_first(parents, pages)
+
+    def _log_schedule_report(self, endpoint, parents, scheduled, elapsed):
+        """
+        Logs the tail time saved by the order used compared to the original order of the parents,
+        estimated from the pages fetched in this run
+        """
+        previous_stats = self.previous_parent_stats.get(endpoint, {})
+        if not any(parent[KEY_GID] in previous_stats for parent in parents):
+            return
+        pages = self._parent_pages(endpoint, parents, self.parent_stats)
+        scheduled_pages = self._parent_pages(endpoint, scheduled, self.parent_stats)
+        workers = min(self.batch_size, len(pages))
+        saved_pages = estimate_makespan(pages, workers) - estimate_makespan(scheduled_pages, workers)
+        if saved_pages <= 0 or elapsed <= 0:
+            return
+        seconds_per_page = elapsed * workers / sum(pages)
+        logging.info(f"Parents of {endpoint} fetched largest first, estimated tail time saved: "
+                     f"{saved_pages * seconds_per_page:.1f} s ({saved_pages} pages)")
 
     @staticmethod
     async def _generate_root_id():
@@ -208,39 +523,32 @@ class AsanaClient(AsyncHttpClient):
         return gen_index
 
     def _init_tmp_folders(self):
-        # create file if not exist
         for endpoint in self.root_endpoints_data:
-            file_path = self._construct_tmp_folder_name(endpoint)
-            if not os.path.exists(file_path):
-                os.makedirs(file_path, exist_ok=True)
-            else:
-                for file in os.listdir(file_path):
-                    os.remove(os.path.join(file_path, file))
-
-    @staticmethod
-    def _construct_tmp_folder_name(endpoint):
-        file_path = f'{TMP_FOLDER_PATH}/{endpoint}'
-        return file_path
+            self.tmp_store.reset(endpoint)
 
     def _write_endpoint_data_to_tmp(self, data, endpoint, file_index=None):
-        file_path = self._construct_tmp_folder_name(endpoint)
-        with open(f'{file_path}/{file_index}.json', 'w') as f:
-            json.dump(data, f)
+        self.tmp_store.write(endpoint, file_index, data)
+
+    async def _drain_endpoint_tmp(self, endpoint):
+        """
+        Parses the endpoint data fetched so far into the output tables and frees the tmp space
+        """
+        await self._parse_endpoint_data_from_tmp(endpoint)
+        self.tmp_store.reset(endpoint)
 
     async def _parse_endpoint_data_from_tmp(self, endpoint):
-        # read every file in the endpoint folder
-        file_counter = 0
+        # read every record of the endpoint segments
+        record_counter = 0
         data_counter = 0
-        for file in os.listdir(self._construct_tmp_folder_name(endpoint)):
-            file_counter += 1
-            with open(f'{self._construct_tmp_folder_name(endpoint)}/{file}', 'r+') as f:
-                file_data = json.load(f)
-                self._save_parent_endpoint_data(file_data, endpoint)
-                file_name = file.split('.')[0]
-                data_counter += len(file_data)
-                await self._mapping_endpoint_data_to_output(file_data, endpoint, i_id=file_name)
+        for parent_id, record_data in self.tmp_store.iter_records(endpoint):
+            record_counter += 1
+            self._save_parent_endpoint_data(record_data, endpoint)
+            data_counter += len(record_data)
+            await self._mapping_endpoint_data_to_output(record_data, endpoint, i_id=parent_id)
+            if endpoint == 'projects_tasks' and self.derive_section_tasks:
+                await self._output_section_tasks_from_memberships(record_data, project_id=parent_id)
 
-        logging.debug(f"Parsed data count: {data_counter} from tmp files({file_counter}), endpoint: {endpoint}")
+        logging.debug(f"Parsed data count: {data_counter} from tmp records({record_counter}), endpoint: {endpoint}")
 
     async def _mapping_endpoint_data_to_output(self, data_out, endpoint, i_id=None):
         MappingParser(
@@ -250,14 +558,104 @@ class AsanaClient(AsyncHttpClient):
             mapping=self.mappings[self.request_map[endpoint]['mapping']],
             parent_key=i_id,
             incremental=self.incremental,
-            add_timestamp=self.membership_timestamp
+            add_timestamp=self.membership_timestamp,
+            change_index=self.change_index
         )
 
+    def _finalize_change_index(self):
+        """
+        Outputs primary keys of rows missing in fully fetched tables into <table>_deleted tables
+        and stores the change index
+        """
+        for endpoint in self.fetched_endpoints:
+            if self._is_partial(endpoint):
+                mapping_name = self.request_map[endpoint]['mapping']
+                self.change_index.mark_partial(self._mapping_tables(self.mappings[mapping_name], mapping_name))
+
+        if self.output_deletions:
+            for table, primary_key, deleted in self.change_index.pop_deleted():
+                logging.info(f"Rows deleted from {table}: {len(deleted)}")
+                MappingParser(
+                    destination=f'{self.tables_out_path}',
+                    endpoint=f'{table}_deleted',
+                    endpoint_data=deleted,
+                    mapping={column: {'mapping': {'destination': column, 'primaryKey': True}}
+                             for column in primary_key},
+                    incremental=self.incremental
+                )
+        self.change_index.close()
+
+    def _is_partial(self, endpoint):
+        # section tasks derived from memberships are as complete as the project tasks
+        if endpoint == 'projects_sections_tasks' and self.derive_section_tasks:
+            endpoint = 'projects_tasks'
+        while endpoint:
+            if endpoint in self.partial_endpoints:
+                return True
+            endpoint = self.request_map[endpoint].get('required')
+        return False
+
+    def _mapping_tables(self, mapping, table):
+        tables = [table]
+        for column in mapping.values():
+            if column.get('type') == 'table':
+                tables.extend(self._mapping_tables(column['tableMapping'], column['destination']))
+        return tables
+
+    async def _output_section_tasks_from_memberships(self, tasks_data, project_id):
+        """
+        Builds section_tasks rows from the memberships of tasks listed for a project,
+        only memberships belonging to the listed project are used
+        """
+        section_tasks = {}
+        for task in tasks_data:
+            for membership in task.get(KEY_MEMBERSHIPS) or []:
+                section = membership.get('section') or {}
+                project = membership.get('project') or {}
+                if not section.get(KEY_GID) or project.get(KEY_GID) != project_id:
+                    continue
+                section_tasks.setdefault(section[KEY_GID], []).append({
+                    KEY_GID: task[KEY_GID],
+                    'resource_type': task.get('resource_type'),
+                    'name': task.get('name')
+                })
+
+        for section_id, data in section_tasks.items():
+            await self._mapping_endpoint_data_to_output(data, 'projects_sections_tasks', i_id=section_id)
+
     def _save_parent_endpoint_data(self, data, endpoint):
         for i in data:
             data_to_save = self._check_endpoint_rules(endpoint, i)
+            if endpoint == 'projects_details':
+                self._check_project_watermark(i, data_to_save)
             self.root_endpoints_data[endpoint].append(data_to_save)
 
+    def _can_prune_unchanged_projects(self):
+        """
+        Projects can be skipped only with incremental load of the output tables
+        and only when the previous run fetched all endpoints needed now
+        """
+        previous_endpoints = set(self.previous_project_watermarks.get(KEY_WATERMARK_ENDPOINTS, []))
+        return bool(self.skip_unchanged_projects and self.incremental
+                    and self.endpoints_needed.issubset(previous_endpoints))
+
+    def _check_project_watermark(self, data, data_to_save):
+        modified_at = data.get(KEY_MODIFIED_AT)
+        if not modified_at:
+            return
+        self.project_watermarks[data[KEY_GID]] = modified_at
+
+        previous = self.previous_project_watermarks.get(KEY_MODIFIED_AT, {}).get(data[KEY_GID])
+        if self.prune_unchanged_projects and previous and \
+                self._parse_timestamp(modified_at) <= self._parse_timestamp(previous):
+            data_to_save[KEY_UNCHANGED] = True
+
+    def get_project_watermarks(self):
+        """
+        Project modified_at watermarks of this run to be stored in the state
+        """
+        return {KEY_WATERMARK_ENDPOINTS: sorted(self.endpoints_needed), KEY_MODIFIED_AT: self.project_watermarks}
+
     @staticmethod
     def _check_endpoint_rules(endpoint, data):
         data_to_save = {KEY_GID: data[KEY_GID]}
@@ -267,6 +665,13 @@ class AsanaClient(AsyncHttpClient):
                 logging.info(f"Skipping endpoint users for personal workspaces is not allowed: {data['gid']}")
                 data_to_save = {KEY_GID: data[KEY_GID], KEY_FORBIDDEN_ENDPOINTS: ['users']}
 
+        # Needed for splitting the task listing of oversized projects
+        elif endpoint == 'projects_details':
+            if workspace_gid := (data.get('workspace') or {}).get(KEY_GID):
+                data_to_save[KEY_WORKSPACE_GID] = workspace_gid
+            if data.get(KEY_CREATED_AT):
+                data_to_save[KEY_CREATED_AT] = data[KEY_CREATED_AT]
+
         return data_to_save
 
     def add_parent_endpoint_manually(self, id_str, endpoint):
@@ -307,17 +712,18 @@ class AsanaClient(AsyncHttpClient):
             levels[level].sort()
         return levels
 
-    async def _get_request(self, endpoint_url, endpoint, endpoint_id, params=None):
+    async def _get_request(self, endpoint_url, endpoint, endpoint_id, params=None, parent_data=None):
         """
         Generic Get request
         """
-        # Pagination parameters
-        if not params:
-            params = {}
+        # Pagination parameters, copied as the same params are shared by all parents of the batch
+        params = dict(params) if params else {}
         params['limit'] = API_PAGE_LIMIT
         pagination_offset = None
 
         data = []
+        pages = 0
+        requests = 0
         while True:
             # If pagination parameter exist
             if pagination_offset:
@@ -329,10 +735,13 @@ class AsanaClient(AsyncHttpClient):
                 if e.status_code == 403:
                     if self.skip_unauthorized:
                         logging.warning(f"Skipping unauthorized request: {e}")
+                        self.partial_endpoints.add(endpoint)
                         break
                 else:
                     raise AsanaClientException(e)
 
+            pages += 1
+            requests += 1
             try:
                 data.extend([r['data']] if isinstance(r['data'], dict) else r['data'])
             except KeyError:
@@ -341,27 +750,259 @@ class AsanaClient(AsyncHttpClient):
             # Loop
             if r.get('next_page'):
                 pagination_offset = r['next_page']['offset']
+                if self._should_split(endpoint, parent_data, pages):
+                    split_result = await self._get_split_request(endpoint, parent_data, params)
+                    if split_result is not None:
+                        split_data, split_requests = split_result
+                        data = self._merge_unique(data, split_data)
+                        pages = -(-len(data) // API_PAGE_LIMIT)
+                        requests += split_requests
+                        break
             else:
                 params.pop("offset", None)
                 break
 
+        # Single page parents are not stored to keep the state small
+        if pages > 1:
+            self.parent_stats.setdefault(endpoint, {})[endpoint_id] = [requests, pages]
+        elif endpoint_id in self.parent_stats.get(endpoint, {}):
+            del self.parent_stats[endpoint][endpoint_id]
         self._write_endpoint_data_to_tmp(data, endpoint, endpoint_id)
 
+    def _should_split(self, endpoint, parent_data, pages):
+        """
+        Parent is split when it is known to be oversized from the previous run
+        or when the listing still continues after the threshold number of pages
+        """
+        if not self.split_page_threshold or endpoint not in SPLITTABLE_ENDPOINTS or not parent_data:
+            return False
+        if not parent_data.get(KEY_WORKSPACE_GID) or not parent_data.get(KEY_CREATED_AT):
+            return False
+        previous_pages = self.previous_parent_stats.get(endpoint, {}).get(parent_data[KEY_GID], [0, 0])[1]
+        return pages >= self.split_page_threshold or (pages == 1 and previous_pages >= self.split_page_threshold)
+
+    async def _get_split_request(self, endpoint, parent_data, params):
+        """
+        Fetches the listing of a parent as created_at windows of the workspace task search paginated in parallel.
+        Returns the data and the number of requests, None when the search is not available,
+        the sequential pagination is used then.
+        """
+        parent_id = parent_data[KEY_GID]
+        endpoint_url = SPLITTABLE_ENDPOINTS[endpoint].replace('{workspace_id}', parent_data[KEY_WORKSPACE_GID])
+        opt_fields = SPLIT_OPT_FIELDS
+        if params.get('opt_fields'):
+            opt_fields = f"{opt_fields},{params['opt_fields']}"
+        search_params = {'projects.any': parent_id, 'sort_by': 'created_at', 'sort_ascending': 'true',
+                         'opt_fields': opt_fields}
+
+        windows = self._generate_time_windows(self._parse_timestamp(parent_data[KEY_CREATED_AT]),
+                                              self._get_split_reference_time(), self.split_windows)
+        logging.info(f"Splitting {endpoint} of parent {parent_id} into {len(windows)} created_at windows")
+
+        if self.split_slots is None:
+            self.split_slots = asyncio.Semaphore(max(self.split_windows, 1))
+        tasks = [asyncio.create_task(self._get_window(endpoint_url, search_params, window_start, window_end))
+                 for window_start, window_end in windows]
+        try:
+            windows_data = await asyncio.gather(*tasks)
+        except AsanaClientException as e:
+            logging.warning(f"Splitting of {endpoint} is not available, continuing sequentially, exception: {e}")
+            self.split_page_threshold = 0
+            return None
+        finally:
+            # windows still running are stopped when any of them fails
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        data = self._merge_unique(*[window_data for window_data, _ in windows_data])
+        requests = sum(window_requests for _, window_requests in windows_data)
+        if completed_since := params.get('completed_since'):
+            completed_since = self._parse_timestamp(completed_since)
+            data = [task for task in data if not task.get('completed') or not task.get('completed_at')
+                    or self._parse_timestamp(task['completed_at']) >= completed_since]
+        return data, requests
+
+    def _get_archived_completed_since(self, completed_since):
+        """
+        The completed_since filter is part of the recorded requests, it moves with every run,
+        so it is stored in the HTTP archive when recording and taken from it when replaying
+        """
+        if self.http_archive and self.http_archive.replaying:
+            return self.http_archive.metadata.get(KEY_COMPLETED_SINCE, completed_since)
+        if self.http_archive:
+            self.http_archive.record_metadata(KEY_COMPLETED_SINCE, completed_since)
+        return completed_since
+
+    def _get_split_reference_time(self):
+        """
+        End of the split windows, the same for the whole run. It is stored in the HTTP archive when recording
+        and taken from it when replaying.
+        """
+        if self.split_reference_time is None:
+            reference_time = self._format_timestamp(datetime.datetime.now(datetime.timezone.utc))
+            if self.http_archive and self.http_archive.replaying:
+                reference_time = self.http_archive.metadata.get(KEY_SPLIT_REFERENCE_TIME, reference_time)
+            elif self.http_archive:
+                self.http_archive.record_metadata(KEY_SPLIT_REFERENCE_TIME, reference_time)
+            self.split_reference_time = self._parse_timestamp(reference_time)
+        return self.split_reference_time
+
+    async def _get_window(self, endpoint_url, params, window_start, window_end):
+        """
+        Paginates a single created_at window, the search has no offset so the last created_at is used as a cursor
+        """
+        async with self.split_slots:
+            return await self._paginate_window(endpoint_url, params, window_start, window_end)
+
+    async def _paginate_window(self, endpoint_url, params, window_start, window_end):
+        data = []
+        requests = 0
+        cursor = None
+        while True:
+            window_params = {**params, 'limit': API_PAGE_LIMIT}
+            # The cursor is moved back slightly as tasks created at the same time as the last one may be left
+            if cursor:
+                window_params['created_at.after'] = self._format_timestamp(cursor - SPLIT_CURSOR_OVERLAP)
+            elif window_start:
+                window_params['created_at.after'] = self._format_timestamp(window_start)
+            if window_end:
+                window_params['created_at.before'] = self._format_timestamp(window_end)
+
+            r = await self._get(endpoint=endpoint_url, params=window_params)
+            requests += 1
+            page = r.get('data', [])
+            data.extend(page)
+            if len(page) < API_PAGE_LIMIT:
+                break
+
+            next_cursor = self._parse_timestamp(page[-1][KEY_CREATED_AT])
+            if cursor and next_cursor <= cursor:
+                raise AsanaClientException(f"Cannot paginate {endpoint_url} window, "
+                                           f"more than {API_PAGE_LIMIT} tasks created at {next_cursor}")
+            cursor = next_cursor
+        return self._merge_unique(data), requests
+
+    @staticmethod
+    def _generate_time_windows(start, end, count):
+        """
+        Splits the interval into overlapping windows, the first and last windows are open-ended
+        so that tasks created before the parent or during the run are included as well
+        """
+        count = max(count, 1)
+        step = (end - start) / count
+        windows = []
+        for i in range(count):
+            window_start = start + step * i - SPLIT_WINDOW_OVERLAP if i > 0 else None
+            window_end = start + step * (i + 1) + SPLIT_WINDOW_OVERLAP if i < count - 1 else None
+            windows.append((window_start, window_end))
+        return windows
+
+    @staticmethod
+    def _merge_unique(*data_lists):
+        seen = set()
+        merged = []
+        for data in data_lists:
+            for item in data:
+                if item[KEY_GID] not in seen:
+                    seen.add(item[KEY_GID])
+                    merged.append(item)
+        return merged
+
+    @staticmethod
+    def _parse_timestamp(timestamp):
+        return datetime.datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+
+    @staticmethod
+    def _format_timestamp(timestamp):
+        return timestamp.astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
     async def _get(self, endpoint: str, params=None) -> dict:
         self.counter += 1
 
         if params is None:
             params = {}
 
+        if self.http_archive and self.http_archive.replaying:
+            return await self._get_replayed(endpoint, params)
+
         try:
             logging.debug(f'{endpoint} Parameters: {params}')
-            r = await self.get_raw(endpoint, params=params)
+            if self.token_pool:
+                r = await self._get_pooled(endpoint, params)
+            else:
+                r = await self.get_raw(endpoint, params=params)
             r.raise_for_status()
         except HTTPStatusError as e:
+            if self.http_archive:
+                self.http_archive.record(endpoint, params, e.response.status_code)
             raise AsanaClientException(f"Cannot fetch resource: {endpoint}, exception: {e}",
                                        status_code=e.response.status_code) from e
 
         try:
-            return r.json()
+            response = r.json()
         except json.decoder.JSONDecodeError as e:
             raise AsanaClientException(f"Cannot parse response for {endpoint}, exception: {e}") from e
+
+        if self.http_archive:
+            self.http_archive.record(endpoint, params, r.status_code, response)
+        return response
+
+    async def _get_replayed(self, endpoint: str, params: dict) -> dict:
+        """
+        Serves the response recorded in the HTTP archive, recorded errors are raised as they were
+        """
+        status_code, response = await self.http_archive.replay(endpoint, params)
+        if status_code >= 400:
+            raise AsanaClientException(f"Cannot fetch resource: {endpoint}, replayed status code: {status_code}",
+                                       status_code=status_code)
+        return response
+
+    async def _get_pooled(self, endpoint: str, params: dict):
+        """
+        Sends the request with the next usable token of the pool, the request is repeated with another token
+        when the token is throttled or forbidden. Other retryable failures are retried with a backoff,
+        every attempt waits for the rate limiter of its token.
+        """
+        excluded = set()
+        error = None
+        retries = 0
+        for _ in range(len(self.token_pool) * (REQUEST_RETRIES + 1)):
+            token = await self.token_pool.acquire(excluded)
+            if token is None:
+                break
+            try:
+                r = await self.get_raw(endpoint, params=params, headers=token.auth_header)
+                r.raise_for_status()
+                return r
+            except HTTPStatusError as e:
+                error = e
+                status_code = e.response.status_code
+                if status_code == TOKEN_THROTTLED_STATUS:
+                    retry_after = e.response.headers.get('Retry-After')
+                    token.throttle(float(retry_after) if retry_after else None)
+                    logging.debug(f"Token {token.index} throttled, retrying {endpoint} with another token")
+                elif status_code in TOKEN_FORBIDDEN_STATUSES:
+                    excluded.add(token.index)
+                    if status_code == 401:
+                        logging.warning(f"Token {token.index} is not authorized, it will not be used anymore")
+                        token.disabled = True
+                elif status_code in RETRY_STATUS_CODES and retries < REQUEST_RETRIES:
+                    retries += 1
+                    await self._pooled_backoff(endpoint, retries, e)
+                else:
+                    raise
+            except TransportError as e:
+                if retries >= REQUEST_RETRIES:
+                    raise
+                retries += 1
+                await self._pooled_backoff(endpoint, retries, e)
+
+        if error is None:
+            raise AsanaClientException(f"Cannot fetch resource: {endpoint}, no usable token left")
+        raise error
+
+    async def _pooled_backoff(self, endpoint, retry, error):
+        backoff = 0 if retry == 1 else self.backoff_factor * (2 ** (retry - 2))
+        logging.error(f"Retry attempt {retry} for {endpoint}: {type(error).__name__}, {error}")
+        await asyncio.sleep(backoff)
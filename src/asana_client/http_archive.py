@@ -0,0 +1,96 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import zlib
+
+MODE_RECORD = 'record'
+MODE_REPLAY = 'replay'
+
+
+class HttpArchiveException(Exception):
+    pass
+
+
+class HttpArchive:
+    """
+    Gzipped JSON lines archive of API requests and their responses.
+
+    In the record mode every response (or error status) is appended to the archive, in the replay mode responses
+    are served from the archive without any network access, optionally with a simulated latency.
+    Values the requests depend on, such as the current time, are stored as metadata so that the replayed
+    requests are the same as the recorded ones.
+    """
+
+    def __init__(self, path, mode, latency_ms: float = 0):
+        if mode not in (MODE_RECORD, MODE_REPLAY):
+            raise HttpArchiveException(f"Unknown HTTP archive mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency = latency_ms / 1000
+        self._responses = {}
+        self.metadata = {}
+        self._file = None
+
+        if mode == MODE_RECORD:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._file = gzip.open(path, 'wt', encoding='utf-8')
+        else:
+            self._load()
+
+    @property
+    def replaying(self):
+        return self.mode == MODE_REPLAY
+
+    @property
+    def recording(self):
+        return self.mode == MODE_RECORD
+
+    def record(self, endpoint, params, status_code, body=None):
+        self._file.write(json.dumps({'key': self._request_key(endpoint, params), 'status_code': status_code,
+                                     'body': body}, separators=(',', ':')) + '\n')
+
+    def record_metadata(self, key, value):
+        self.metadata[key] = value
+        self._file.write(json.dumps({'metadata': key, 'value': value}, separators=(',', ':')) + '\n')
+
+    async def replay(self, endpoint, params):
+        """
+        Returns the status code and the body recorded for the request,
+        repeated requests get the recorded responses in the original order
+        """
+        key = self._request_key(endpoint, params)
+        responses = self._responses.get(key)
+        if not responses:
+            raise HttpArchiveException(f"Request not found in the HTTP archive: {key}")
+        response = responses.pop(0) if len(responses) > 1 else responses[0]
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return response['status_code'], response['body']
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            raise HttpArchiveException(f"HTTP archive not found: {self.path}")
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    response = json.loads(line)
+                    if 'metadata' in response:
+                        self.metadata[response['metadata']] = response['value']
+                        continue
+                    self._responses.setdefault(response.pop('key'), []).append(response)
+        except (EOFError, gzip.BadGzipFile, zlib.error, json.JSONDecodeError) as e:
+            # a recording which failed before the archive was closed ends with an incomplete entry
+            logging.warning(f"HTTP archive {self.path} is truncated, replaying the complete entries only: {e}")
+
+    @staticmethod
+    def _request_key(endpoint, params):
+        params = {k: str(v) for k, v in (params or {}).items()}
+        return f"{endpoint.lstrip('/')}?{json.dumps(params, sort_keys=True)}"
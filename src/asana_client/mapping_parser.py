@@ -2,13 +2,12 @@ import os
 import json
 import logging  # noqa
 import sys  # noqa
-import pandas as pd
 import time
 
 
 class MappingParser:
     def __init__(self, destination, endpoint, endpoint_data, mapping, parent_key=None, incremental=False,
-                 add_timestamp=False, generate_timestamp=False):
+                 add_timestamp=False, generate_timestamp=False, change_index=None, output_rows=None):
 
         self.destination = destination
         self.endpoint = endpoint
@@ -19,6 +18,9 @@ class MappingParser:
         self.primary_key = []
         self.incremental = incremental
         self.add_timestamp = add_timestamp
+        self.change_index = change_index
+        # When a list is given, (table, row) tuples are collected into it instead of writing the tables
+        self.output_rows = output_rows
 
         # Countermeasures for response coming in as DICT
         if isinstance(self.endpoint_data, dict):
@@ -27,15 +29,24 @@ class MappingParser:
 
         # Parsing
         self.parse()
+        if self.change_index:
+            self.change_index.touch(self.endpoint)
         if self.output:
             pk = self.primary_key
+            # Only new and changed rows are written, the timestamp of the run is not a change
+            if self.change_index:
+                self.output = self.change_index.filter_changed(self.endpoint, list(pk), self.output)
+
             if generate_timestamp:
                 self.output = self._add_timestamp(df_json=self.output)
                 pk.append("timestamp")
                 pk.remove("section_id")
 
-            self._output(df_json=self.output, filename=self.endpoint)
-            self._produce_manifest(filename=self.endpoint, incremental=self.incremental, primary_key=pk)
+            if self.output_rows is not None:
+                self.output_rows.extend((self.endpoint, row) for row in self.output)
+            elif self.output:
+                self._output(df_json=self.output, filename=self.endpoint)
+                self._produce_manifest(filename=self.endpoint, incremental=self.incremental, primary_key=pk)
 
     def parse(self):
         for row in self.endpoint_data:
@@ -81,7 +92,9 @@ class MappingParser:
                         mapping=mapping,
                         parent_key=parent_key,
                         incremental=self.incremental,
-                        generate_timestamp=generate_timestamp
+                        generate_timestamp=generate_timestamp,
+                        change_index=self.change_index,
+                        output_rows=self.output_rows
                     )
 
             self.output.append(row_json)
@@ -105,6 +118,9 @@ class MappingParser:
     def _output(self, df_json, filename):
         output_filename = f'{self.destination}/{filename}.csv'
         if df_json:
+            # pandas is imported only when there is something to write as its import is slow
+            import pandas as pd
+
             data_output = pd.DataFrame(df_json, dtype=str)
             if not os.path.isfile(output_filename):
                 with open(output_filename, 'a') as b:
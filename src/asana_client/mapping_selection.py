@@ -0,0 +1,67 @@
+import copy
+import logging
+
+TYPE_TABLE = 'table'
+TYPE_USER = 'user'
+
+
+def select_mappings(mappings, column_selection=None, skip_tables=None):
+    """
+    Returns copy of the mappings with only the selected columns and child tables.
+
+    column_selection maps an output table to the output columns to keep, primary key and parent id columns
+    are always kept. Child tables listed in skip_tables are removed together with their own child tables.
+    """
+    column_selection = column_selection or {}
+    skip_tables = set(skip_tables or [])
+    mappings = copy.deepcopy(mappings)
+
+    known_tables = set()
+    for table, mapping in mappings.items():
+        mappings[table] = _select_mapping(table, mapping, column_selection, skip_tables, known_tables)
+
+    for table in (set(column_selection) | skip_tables) - known_tables:
+        logging.warning(f"Table {table} selected in the configuration does not exist")
+    return mappings
+
+
+def _select_mapping(table, mapping, column_selection, skip_tables, known_tables):
+    known_tables.add(table)
+    selected_columns = column_selection.get(table)
+    selected = {}
+    for key, column in mapping.items():
+        col_type = column.get('type')
+        if col_type == TYPE_TABLE:
+            known_tables.add(column['destination'])
+            if column['destination'] in skip_tables:
+                continue
+            column = dict(column, tableMapping=_select_mapping(column['destination'], column['tableMapping'],
+                                                               column_selection, skip_tables, known_tables))
+        elif col_type != TYPE_USER and selected_columns is not None:
+            if column['mapping']['destination'] not in selected_columns and 'primaryKey' not in column['mapping']:
+                continue
+        selected[key] = column
+
+    if selected_columns is not None:
+        known_columns = {column['mapping']['destination'] for column in mapping.values()
+                         if column.get('type') != TYPE_TABLE}
+        for name in sorted(set(selected_columns) - known_columns):
+            logging.warning(f"Column {name} selected in the configuration does not exist in table {table}")
+    return selected
+
+
+def mapping_opt_fields(mapping, prefix=''):
+    """
+    Fields of the API objects used by the mapping in the opt_fields format
+    """
+    fields = []
+    for key, column in mapping.items():
+        col_type = column.get('type')
+        if col_type == TYPE_USER:
+            continue
+        if col_type == TYPE_TABLE:
+            child_fields = mapping_opt_fields(column['tableMapping'], prefix=f'{prefix}{key}.')
+            fields.extend(child_fields or [f'{prefix}{key}'])
+        else:
+            fields.append(f'{prefix}{key}')
+    return fields
@@ -0,0 +1,133 @@
+import asyncio
+import contextlib
+import gc
+import logging
+import os
+import time
+
+MB = 1024 * 1024
+STATM_PATH = '/proc/self/statm'
+
+# Memory is checked at most once per interval, the check runs a full garbage collection when over the budget
+MEMORY_CHECK_INTERVAL = 1.0
+# The number of parents fetched at once is raised again once the memory drops below this share of the budget
+LOW_WATER_RATIO = 0.8
+
+
+class ResourceGovernor:
+    """
+    Keeps the extraction within the memory (RSS) and tmp disk budgets.
+
+    When the tmp disk budget is exceeded the fetched data are drained (parsed into the output tables and removed
+    from tmp) before new parents are fetched. Above the memory budget the number of parents fetched at once is halved
+    while the memory keeps growing and doubled back once it drops below the low-water mark, as the memory is held
+    by the parents in flight rather than by the drained data.
+    """
+
+    def __init__(self, max_memory_mb: int = None, max_tmp_disk_mb: int = None,
+                 check_interval: float = MEMORY_CHECK_INTERVAL):
+        self.max_memory_mb = max_memory_mb
+        self.max_tmp_disk_mb = max_tmp_disk_mb
+        self.check_interval = check_interval
+        self.batch_limit = None
+        self.throttled_seconds = 0.0
+        self.throttle_count = 0
+        self._last_check = None
+        self._limited_at_memory = 0.0
+        self._in_flight = {}
+        self._slots = None
+
+    @staticmethod
+    def current_memory_mb():
+        try:
+            with open(STATM_PATH) as f:
+                resident_pages = int(f.read().split()[1])
+        except (OSError, ValueError, IndexError):
+            return 0
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / MB
+
+    def tmp_disk_exceeded(self, tmp_size):
+        return bool(self.max_tmp_disk_mb) and tmp_size / MB > self.max_tmp_disk_mb
+
+    def limit_batch_size(self, batch_size):
+        return min(batch_size, self.batch_limit) if self.batch_limit else batch_size
+
+    @contextlib.asynccontextmanager
+    async def fetch_slot(self, endpoint, batch_size):
+        """
+        Waits until fewer parents of the endpoint than the current limit are being fetched,
+        every endpoint has its own batch_size parents, without the memory budget there is no waiting
+        """
+        if not self.max_memory_mb:
+            yield
+            return
+
+        if self._slots is None:
+            self._slots = asyncio.Condition()
+        async with self._slots:
+            start = time.monotonic() if self.limit_batch_size(batch_size) < batch_size else None
+            await self._slots.wait_for(lambda: self._in_flight.get(endpoint, 0) < self.limit_batch_size(batch_size))
+            if start is not None:
+                self.throttled_seconds += time.monotonic() - start
+            self._in_flight[endpoint] = self._in_flight.get(endpoint, 0) + 1
+        try:
+            yield
+        finally:
+            async with self._slots:
+                self._in_flight[endpoint] -= 1
+                self._slots.notify_all()
+
+    async def throttle(self, tmp_size, batch_size, drain):
+        """
+        Drains the fetched data when the tmp disk budget is exceeded and adjusts the number of parents fetched
+        at once to the memory budget, returns True when the fetching was throttled
+        """
+        throttled = False
+        if self.tmp_disk_exceeded(tmp_size):
+            start = time.monotonic()
+            await drain()
+            self.throttled_seconds += time.monotonic() - start
+            throttled = True
+
+        if await self._check_memory(batch_size):
+            throttled = True
+
+        if throttled:
+            self.throttle_count += 1
+        return throttled
+
+    async def _check_memory(self, batch_size):
+        if not self.max_memory_mb:
+            return False
+        now = time.monotonic()
+        if self._last_check is not None and now - self._last_check < self.check_interval:
+            return False
+        self._last_check = now
+
+        memory = self.current_memory_mb()
+        if memory > self.max_memory_mb:
+            gc.collect()
+            memory = self.current_memory_mb()
+
+        limit = self.limit_batch_size(batch_size)
+        if memory > self.max_memory_mb and memory > self._limited_at_memory and limit > 1:
+            # lowered again only if the memory still grows with the current limit
+            self._limited_at_memory = memory
+            self.batch_limit = limit // 2
+            logging.debug(f"Memory budget exceeded ({memory:.0f} MB), fetching {self.batch_limit} parents at once")
+            return True
+
+        if self.batch_limit and memory < self.max_memory_mb * LOW_WATER_RATIO:
+            self._limited_at_memory = 0.0
+            self.batch_limit = self.batch_limit * 2 if self.batch_limit * 2 < batch_size else None
+            logging.debug(f"Memory below the budget ({memory:.0f} MB), "
+                          f"fetching {self.limit_batch_size(batch_size)} parents at once")
+            if self._slots is not None:
+                async with self._slots:
+                    self._slots.notify_all()
+        return False
+
+    def log_report(self):
+        if self.throttle_count:
+            logging.info(f"Fetching was throttled {self.throttle_count} times to stay within the resource budgets, "
+                         f"{self.throttled_seconds:.1f} s were spent draining and waiting for fetch slots")
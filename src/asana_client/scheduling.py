@@ -0,0 +1,21 @@
+import heapq
+
+
+def order_largest_first(items, costs):
+    """
+    Orders items by their estimated costs, largest first (LPT), the original order is kept on ties
+    """
+    return [item for _, item in sorted(zip(costs, items), key=lambda cost_item: -cost_item[0])]
+
+
+def estimate_makespan(costs, workers):
+    """
+    Simulates the greedy list scheduling of the costs in the given order on the number of workers
+    and returns the cost of the busiest worker
+    """
+    if not costs:
+        return 0
+    finish_times = [0] * max(1, min(workers, len(costs)))
+    for cost in costs:
+        heapq.heapreplace(finish_times, finish_times[0] + cost)
+    return max(finish_times)
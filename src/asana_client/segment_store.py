@@ -0,0 +1,151 @@
+import json
+import mmap
+import os
+import shutil
+
+DEFAULT_SEGMENT_SIZE = 256 * 1024 * 1024
+
+SEGMENT_FILE_NAME = 'segment-{:05d}.bin'
+INDEX_FILE_NAME = 'index.tsv'
+
+
+class SegmentStore:
+    """
+    Append-only store of fetched endpoint data.
+
+    Data of every parent is appended to large segment files of the endpoint folder instead of a file per parent,
+    an offset index (parent id, segment, offset, length) is kept in memory and in the index file of the endpoint.
+    The index is rebuilt from the index file when the endpoint data were written by another store instance.
+    """
+
+    def __init__(self, path, max_segment_size=DEFAULT_SEGMENT_SIZE):
+        self.path = path
+        self.max_segment_size = max_segment_size
+        self._index = {}
+        self._segments = {}
+        self._sizes = {}
+        self._writers = {}
+
+    def reset(self, endpoint):
+        """
+        Removes all data of the endpoint
+        """
+        self._close_writer(endpoint)
+        folder = self._endpoint_folder(endpoint)
+        if os.path.exists(folder):
+            shutil.rmtree(folder)
+        os.makedirs(folder, exist_ok=True)
+        self._index[endpoint] = []
+        self._segments[endpoint] = 0
+        self._sizes[endpoint] = 0
+
+    def write(self, endpoint, parent_id, data):
+        """
+        Appends data of a parent to the current segment of the endpoint
+        """
+        record = json.dumps(data).encode('utf-8')
+        segment, segment_file, index_file = self._get_writer(endpoint, len(record))
+        offset = segment_file.tell()
+        segment_file.write(record)
+
+        entry = (str(parent_id), segment, offset, len(record))
+        self._entries(endpoint).append(entry)
+        index_file.write('\t'.join(str(value) for value in entry) + '\n')
+        self._sizes[endpoint] = self._sizes.get(endpoint, 0) + len(record)
+
+    def size(self, endpoint=None):
+        """
+        Size of the stored data in bytes, of a single endpoint or of the whole store
+        """
+        if endpoint:
+            self._entries(endpoint)
+            return self._sizes.get(endpoint, 0)
+        return sum(self._sizes.values())
+
+    def iter_records(self, endpoint):
+        """
+        Yields (parent id, data) in the order of writing, segments are memory mapped
+        """
+        self._close_writer(endpoint)
+        entries = self._entries(endpoint)
+        current_segment = None
+        segment_file = segment_map = None
+        try:
+            for parent_id, segment, offset, length in entries:
+                if segment != current_segment:
+                    self._close_map(segment_file, segment_map)
+                    segment_file = open(self._segment_path(endpoint, segment), 'rb')
+                    segment_map = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+                    current_segment = segment
+                yield parent_id, json.loads(segment_map[offset:offset + length])
+        finally:
+            self._close_map(segment_file, segment_map)
+
+    def close(self):
+        for endpoint in list(self._writers):
+            self._close_writer(endpoint)
+
+    def _entries(self, endpoint):
+        if endpoint not in self._index:
+            self._load_index(endpoint)
+        return self._index[endpoint]
+
+    def _load_index(self, endpoint):
+        """
+        Rebuilds the offset index of the endpoint from its index file, entries pointing past the end
+        of their segment (a truncated write) and the entries after them are dropped
+        """
+        entries = []
+        index_path = os.path.join(self._endpoint_folder(endpoint), INDEX_FILE_NAME)
+        if os.path.isfile(index_path):
+            segment_sizes = {}
+            with open(index_path) as f:
+                for line in f:
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) != 4:
+                        break
+                    parent_id, segment, offset, length = fields[0], int(fields[1]), int(fields[2]), int(fields[3])
+                    if segment not in segment_sizes:
+                        segment_path = self._segment_path(endpoint, segment)
+                        segment_sizes[segment] = os.path.getsize(segment_path) if os.path.isfile(segment_path) else 0
+                    if offset + length > segment_sizes[segment]:
+                        break
+                    entries.append((parent_id, segment, offset, length))
+
+        self._index[endpoint] = entries
+        self._segments[endpoint] = max((entry[1] for entry in entries), default=0)
+        self._sizes[endpoint] = sum(entry[3] for entry in entries)
+
+    def _get_writer(self, endpoint, record_size):
+        if endpoint not in self._writers:
+            segment = self._segments.setdefault(endpoint, 0)
+            index_file = open(os.path.join(self._endpoint_folder(endpoint), INDEX_FILE_NAME), 'a')
+            self._writers[endpoint] = (segment, open(self._segment_path(endpoint, segment), 'ab'), index_file)
+
+        segment, segment_file, index_file = self._writers[endpoint]
+        if segment_file.tell() and segment_file.tell() + record_size > self.max_segment_size:
+            segment_file.close()
+            segment += 1
+            segment_file = open(self._segment_path(endpoint, segment), 'ab')
+            self._segments[endpoint] = segment
+            self._writers[endpoint] = (segment, segment_file, index_file)
+        return self._writers[endpoint]
+
+    def _close_writer(self, endpoint):
+        if endpoint in self._writers:
+            _, segment_file, index_file = self._writers.pop(endpoint)
+            segment_file.close()
+            index_file.close()
+
+    @staticmethod
+    def _close_map(segment_file, segment_map):
+        if segment_map is not None:
+            segment_map.close()
+        if segment_file is not None:
+            segment_file.close()
+
+    def _endpoint_folder(self, endpoint):
+        return os.path.join(self.path, endpoint)
+
+    def _segment_path(self, endpoint, segment):
+        return os.path.join(self._endpoint_folder(endpoint), SEGMENT_FILE_NAME.format(segment))
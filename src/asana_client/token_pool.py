@@ -0,0 +1,70 @@
+import asyncio
+import itertools
+import time
+
+from aiolimiter import AsyncLimiter
+
+DEFAULT_RETRY_AFTER = 30
+
+
+class PooledToken:
+    def __init__(self, index, token, max_requests_per_second=None):
+        self.index = index
+        self.auth_header = {'Authorization': f'Bearer {token}'}
+        self.limiter = AsyncLimiter(1, 1 / max_requests_per_second) if max_requests_per_second else None
+        self.throttled_until = 0.0
+        self.disabled = False
+        self.requests = 0
+
+    def throttle(self, retry_after=None):
+        self.throttled_until = time.monotonic() + (retry_after or DEFAULT_RETRY_AFTER)
+
+    def is_throttled(self):
+        return self.throttled_until > time.monotonic()
+
+
+class TokenPool:
+    """
+    Spreads requests across several tokens with the same access, every token has its own rate limiter.
+
+    Tokens throttled by the API are not used until their Retry-After passes, invalid tokens are disabled
+    and tokens forbidden to access a resource can be excluded for a single request.
+    """
+
+    def __init__(self, tokens, max_requests_per_second=None):
+        self.tokens = [PooledToken(i, token, max_requests_per_second) for i, token in enumerate(tokens)]
+        self._round_robin = itertools.cycle(self.tokens)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    async def acquire(self, excluded=()):
+        """
+        Returns the next usable token once its rate limiter allows another request,
+        None when every token is excluded or disabled
+        """
+        while True:
+            usable = [token for token in self.tokens if not token.disabled and token.index not in excluded]
+            if not usable:
+                return None
+
+            available = [token for token in usable if not token.is_throttled()]
+            if not available:
+                await asyncio.sleep(min(token.throttled_until for token in usable) - time.monotonic())
+                continue
+
+            token = self._next_available(available)
+            if token.limiter:
+                await token.limiter.acquire()
+            if token.is_throttled() or token.disabled:
+                continue
+            token.requests += 1
+            return token
+
+    def _next_available(self, available):
+        # prefers a token which can be used right away, round-robin otherwise
+        for _ in range(len(self.tokens)):
+            token = next(self._round_robin)
+            if token in available and (not token.limiter or token.limiter.has_capacity()):
+                return token
+        return next(token for token in self._round_robin if token in available)
@@ -2,18 +2,19 @@ import asyncio
 import logging
 import os
 import datetime
-import pytz
-import dateparser
-import pandas as pd
+import shutil
 from typing import Dict
 from keboola.component.base import ComponentBase
 from keboola.component.exceptions import UserException
 
-from asana_client.client import AsanaClient, AsanaClientException, DEFAULT_BATCH_SIZE, DEFAULT_MAX_REQUESTS_PER_SECOND
+from asana_client.client import (AsanaClient, AsanaClientException, DEFAULT_BATCH_SIZE,
+                                 DEFAULT_MAX_REQUESTS_PER_SECOND, DEFAULT_SPLIT_WINDOWS, TMP_FOLDER_PATH)
+from asana_client.http_archive import HttpArchiveException, MODE_REPLAY
 
 # configuration variables
 KEY_DEBUG = 'debug'
 KEY_TOKEN = '#token'
+KEY_ADDITIONAL_TOKENS = 'additional_tokens'
 KEY_INCREMENTAL_LOAD = 'incremental_load'
 KEY_ENDPOINTS = 'endpoints'
 KEY_PROJECT_ID = 'project_id'
@@ -24,6 +25,35 @@ KEY_SKIP_UNAUTHORIZED = "skip_unauthorized"
 KEY_MAX_REQUESTS_PER_SECOND = "max_requests_per_second"
 KEY_BATCH_SIZE = "batch_size"
 KEY_TASK_MEMBERSHIP_TIMESTAMP = "task_membership_timestamp"
+KEY_SECTION_TASKS_FROM_MEMBERSHIPS = "section_tasks_from_memberships"
+KEY_LARGE_PARENT_PAGE_THRESHOLD = "large_parent_page_threshold"
+KEY_LARGE_PARENT_WINDOWS = "large_parent_windows"
+KEY_TMP_PATH = "tmp_path"
+KEY_MAX_MEMORY_MB = "max_memory_mb"
+KEY_MAX_TMP_DISK_MB = "max_tmp_disk_mb"
+KEY_CHANGE_INDEX = "change_index"
+KEY_OUTPUT_DELETIONS = "output_deletions"
+KEY_SKIP_UNCHANGED_PROJECTS = "skip_unchanged_projects"
+KEY_FULL_REFRESH_DAYS = "full_refresh_days"
+
+KEY_HTTP_ARCHIVE_PATH = "http_archive_path"
+KEY_HTTP_ARCHIVE_MODE = "http_archive_mode"
+KEY_REPLAY_LATENCY_MS = "replay_latency_ms"
+KEY_COLUMN_SELECTION = "column_selection"
+KEY_SKIP_TABLES = "skip_tables"
+
+DEFAULT_FULL_REFRESH_DAYS = 7
+
+# state variables
+KEY_STATE_LAST_RUN = 'last_run'
+KEY_STATE_PARENT_STATS = 'parent_stats'
+KEY_STATE_PROJECT_WATERMARKS = 'project_watermarks'
+KEY_STATE_LAST_FULL_REFRESH = 'last_full_refresh'
+KEY_STATE_CHANGE_INDEX = 'change_index'
+
+# The change index is kept between runs as a permanent Storage file, read back through the file input mapping
+CHANGE_INDEX_FILE_NAME = 'asana_change_index.sqlite'
+CHANGE_INDEX_TAG = 'asana-change-index'
 
 REQUIRED_PARAMETERS = [
     KEY_ENDPOINTS,
@@ -44,19 +74,69 @@ class Component(ComponentBase):
         self.skip = self.params.get(KEY_SKIP_UNAUTHORIZED, False)
         self.incremental = self.params.get(KEY_INCREMENTAL_LOAD)
         self.token = self.params.get(KEY_TOKEN)
+        self.additional_tokens = [t.get(KEY_TOKEN) for t in self.params.get(KEY_ADDITIONAL_TOKENS, [])
+                                  if t.get(KEY_TOKEN)]
+        self.state = self.get_state_file()
 
     def run(self):
         self.validate_configuration_parameters(REQUIRED_PARAMETERS)
         self.validate_image_parameters(REQUIRED_IMAGE_PARS)
 
+        # Writing only changed rows is possible only with incremental load of the output tables
+        use_change_index = self.params.get(KEY_CHANGE_INDEX, False)
+        if use_change_index and not self.incremental:
+            logging.warning("Change index is used only with Incremental Load, all rows will be written")
+            use_change_index = False
+        change_index_path = self.load_change_index() if use_change_index else None
+
+        # Deleted rows are found only by the change index
+        output_deletions = self.params.get(KEY_OUTPUT_DELETIONS, False)
+        if output_deletions and not change_index_path:
+            logging.warning("Deleted rows are output only with Write only changed rows and Incremental Load enabled")
+            output_deletions = False
+
+        # Unchanged projects are skipped only between periodic full refreshes and only with incremental load,
+        # a full load would replace the output tables with rows of the changed projects only
+        skip_unchanged_projects = self.params.get(KEY_SKIP_UNCHANGED_PROJECTS, False)
+        if skip_unchanged_projects and not self.incremental:
+            logging.warning("Skipping unchanged projects is used only with Incremental Load, "
+                            "all projects will be fetched")
+            skip_unchanged_projects = False
+        full_refresh = self.is_full_refresh_due()
+        if skip_unchanged_projects and full_refresh:
+            logging.info("Running full refresh, all projects will be fetched")
+        project_watermarks = {} if full_refresh else self.state.get(KEY_STATE_PROJECT_WATERMARKS, {})
+
         # Initialize the client
-        self.client = AsanaClient(destination=self.tables_out_path, api_token=self.token, incremental=self.incremental,
-                                  debug=self.params.get(KEY_DEBUG), skip_unauthorized=self.skip,
-                                  max_requests_per_second=self.params.get(KEY_MAX_REQUESTS_PER_SECOND,
-                                                                          DEFAULT_MAX_REQUESTS_PER_SECOND),
-                                  batch_size=self.params.get(KEY_BATCH_SIZE, DEFAULT_BATCH_SIZE),
-                                  membership_timestamp=self.params.get(KEY_TASK_MEMBERSHIP_TIMESTAMP, False)
-                                  )
+        try:
+            self.client = AsanaClient(destination=self.tables_out_path, api_token=self.token,
+                                      incremental=self.incremental, debug=self.params.get(KEY_DEBUG),
+                                      skip_unauthorized=self.skip,
+                                      max_requests_per_second=self.params.get(KEY_MAX_REQUESTS_PER_SECOND,
+                                                                              DEFAULT_MAX_REQUESTS_PER_SECOND),
+                                      batch_size=self.params.get(KEY_BATCH_SIZE, DEFAULT_BATCH_SIZE),
+                                      membership_timestamp=self.params.get(KEY_TASK_MEMBERSHIP_TIMESTAMP, False),
+                                      section_tasks_from_memberships=self.params.get(KEY_SECTION_TASKS_FROM_MEMBERSHIPS,
+                                                                                     False),
+                                      split_page_threshold=self.params.get(KEY_LARGE_PARENT_PAGE_THRESHOLD, 0),
+                                      split_windows=self.params.get(KEY_LARGE_PARENT_WINDOWS, DEFAULT_SPLIT_WINDOWS),
+                                      parent_stats=self.state.get(KEY_STATE_PARENT_STATS, {}),
+                                      tmp_path=self.params.get(KEY_TMP_PATH, TMP_FOLDER_PATH),
+                                      max_memory_mb=self.params.get(KEY_MAX_MEMORY_MB),
+                                      max_tmp_disk_mb=self.params.get(KEY_MAX_TMP_DISK_MB),
+                                      additional_tokens=self.additional_tokens,
+                                      change_index_path=change_index_path,
+                                      output_deletions=output_deletions,
+                                      skip_unchanged_projects=skip_unchanged_projects,
+                                      project_watermarks=project_watermarks,
+                                      http_archive_path=self.params.get(KEY_HTTP_ARCHIVE_PATH),
+                                      http_archive_mode=self.params.get(KEY_HTTP_ARCHIVE_MODE),
+                                      replay_latency_ms=self.params.get(KEY_REPLAY_LATENCY_MS, 0),
+                                      column_selection=self.params.get(KEY_COLUMN_SELECTION),
+                                      skip_tables=self.params.get(KEY_SKIP_TABLES)
+                                      )
+        except HttpArchiveException as e:
+            raise UserException(f"Failed to open HTTP archive, exception: {e}")
 
         # Validate user inputs
         self.validate_user_inputs(self.params)
@@ -74,12 +154,27 @@ class Component(ComponentBase):
 
         try:
             asyncio.run(self.client.fetch(endpoints, completed_since=self.date_from))
-        except AsanaClientException as e:
+        except (AsanaClientException, HttpArchiveException) as e:
             raise UserException(f"Failed to fetch data, exception: {e}")
 
+        # A replayed run does not fetch anything new, the state and the change index are left as they were
+        if self.params.get(KEY_HTTP_ARCHIVE_MODE) == MODE_REPLAY:
+            logging.info("HTTP archive replayed, the state and the change index are not updated")
+            if change_index_path and os.path.exists(change_index_path):
+                os.remove(change_index_path)
+            self.write_state_file(self.state)
+            return
+
+        if change_index_path:
+            self.store_change_index(change_index_path)
+
         # Always storing the last extraction date
         # if self.incremental:
-        state = {'last_run': self.now}
+        state = {KEY_STATE_LAST_RUN: self.now,
+                 KEY_STATE_PARENT_STATS: self.client.parent_stats,
+                 KEY_STATE_PROJECT_WATERMARKS: self.client.get_project_watermarks(),
+                 KEY_STATE_LAST_FULL_REFRESH: self.now if full_refresh else self.state.get(KEY_STATE_LAST_FULL_REFRESH),
+                 KEY_STATE_CHANGE_INDEX: bool(change_index_path)}
         self.write_state_file(state)
 
         logging.info("Extraction finished")
@@ -91,7 +186,49 @@ class Component(ComponentBase):
         state = self.get_state_file()
         if date_from_raw := load_options.get(KEY_DATE_FROM):
             return self.parse_date(state, date_from_raw)
-        return state.get('last_run')
+        return state.get(KEY_STATE_LAST_RUN)
+
+    @property
+    def change_index_tag(self):
+        config_id = self.environment_variables.config_id
+        return f'{CHANGE_INDEX_TAG}-{config_id}' if config_id else CHANGE_INDEX_TAG
+
+    def load_change_index(self):
+        """
+        Returns the path of the change index used in this run, the index stored by the previous run
+        is copied from the input files, a new index is built when it is missing
+        """
+        change_index_path = os.path.join(self.files_out_path, CHANGE_INDEX_FILE_NAME)
+        os.makedirs(self.files_out_path, exist_ok=True)
+        if not self.state.get(KEY_STATE_CHANGE_INDEX):
+            logging.info("Building a new change index, all rows will be written")
+            return change_index_path
+
+        stored = self.get_input_files_definitions(tags=[self.change_index_tag])
+        if not stored:
+            logging.warning(f"The change index stored by the previous run is missing in the input files, "
+                            f"building a new index and writing all rows. Add a file input mapping "
+                            f"with the tag {self.change_index_tag} and limit 1.")
+            return change_index_path
+        shutil.copyfile(stored[0].full_path, change_index_path)
+        return change_index_path
+
+    def store_change_index(self, change_index_path):
+        # Not permanent, older copies of the index expire in Storage
+        file_definition = self.create_out_file_definition(CHANGE_INDEX_FILE_NAME,
+                                                          tags=[CHANGE_INDEX_TAG, self.change_index_tag])
+        self.write_manifest(file_definition)
+        logging.info(f"Change index stored with the tag {self.change_index_tag}")
+
+    def is_full_refresh_due(self):
+        last_full_refresh = self.state.get(KEY_STATE_LAST_FULL_REFRESH)
+        if not last_full_refresh:
+            return True
+        last_full_refresh = datetime.datetime.strptime(last_full_refresh, '%Y-%m-%dT%H:%M:%SZ').replace(
+            tzinfo=datetime.timezone.utc)
+        full_refresh_days = self.params.get(KEY_FULL_REFRESH_DAYS, DEFAULT_FULL_REFRESH_DAYS)
+        return datetime.datetime.now(datetime.timezone.utc) - last_full_refresh >= datetime.timedelta(
+            days=full_refresh_days)
 
     @staticmethod
     def validate_user_inputs(params):
@@ -121,27 +258,18 @@ class Component(ComponentBase):
                     'Parameters are required when [Projects - User Defined] is selected. Please '
                     'define your project IDs.')
 
-    def _output(self, df_json, filename):
-        output_filename = f'{self.tables_out_path}/{filename}.csv'
-        data_output = pd.DataFrame(df_json, dtype=str)
-        if not os.path.isfile(output_filename):
-            with open(output_filename, 'a') as b:
-                data_output.to_csv(b, index=False)
-        else:
-            with open(output_filename, 'a') as b:
-                data_output.to_csv(b, index=False, header=False)
-
-        b.close()
-
     @staticmethod
     def parse_date(state: Dict, date_str: str) -> str:
         if date_str.lower() in {"last", "lastrun", "last run"}:
-            return state.get('last_run')
+            return state.get(KEY_STATE_LAST_RUN)
+        # dateparser is imported only when needed as its import is slow
+        import dateparser
+
         try:
             date_obj = dateparser.parse(date_str, settings={'TIMEZONE': 'UTC'})
             if date_obj is None:
                 raise ValueError("Invalid date string")
-            date_obj = date_obj.replace(tzinfo=pytz.UTC)
+            date_obj = date_obj.replace(tzinfo=datetime.timezone.utc)
             date_str = date_obj.strftime('%Y-%m-%dT%H:%M:%SZ')
             return date_str
         except ValueError as e:
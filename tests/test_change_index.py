@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+
+from asana_client.change_index import ChangeIndex
+from asana_client.mapping_parser import MappingParser
+
+
+class TestChangeIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'index.sqlite')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _run(self, rows, partial=False):
+        index = ChangeIndex(self.path)
+        index.touch('tasks')
+        if partial:
+            index.mark_partial(['tasks'])
+        changed = index.filter_changed('tasks', ['id'], rows)
+        deleted = list(index.pop_deleted())
+        index.close()
+        return changed, deleted
+
+    def test_only_changed_rows_pass(self):
+        rows = [{'id': '1', 'name': 'a'}, {'id': '2', 'name': 'b'}]
+        self.assertEqual(self._run(rows), (rows, []))
+
+        changed, _ = self._run([{'id': '1', 'name': 'a'}, {'id': '2', 'name': 'changed'}])
+        self.assertEqual(changed, [{'id': '2', 'name': 'changed'}])
+
+    def test_missing_rows_are_deleted_only_from_full_tables(self):
+        self._run([{'id': '1', 'name': 'a'}, {'id': '2', 'name': 'b'}])
+
+        _, deleted = self._run([{'id': '1', 'name': 'a'}], partial=True)
+        self.assertEqual(deleted, [])
+
+        _, deleted = self._run([{'id': '1', 'name': 'a'}])
+        self.assertEqual(deleted, [('tasks', ['id'], [{'id': '2'}])])
+
+    def test_membership_timestamp_is_not_a_change(self):
+        mapping = {'memberships': {'type': 'table', 'destination': 'task_details-memberships', 'tableMapping': {
+            'project.gid': {'type': 'column', 'mapping': {'destination': 'project_id', 'primaryKey': True}},
+            'section.gid': {'type': 'column', 'mapping': {'destination': 'section_id', 'primaryKey': True}},
+            'parent_gid': {'type': 'user', 'mapping': {'destination': 'task_id'}}}}}
+        tasks = [{'gid': 't1', 'memberships': [{'project': {'gid': 'p1'}, 'section': {'gid': 's1'}}]}]
+
+        for expected_rows in (1, 0):
+            rows = []
+            index = ChangeIndex(self.path)
+            MappingParser(destination=self.tmp_dir.name, endpoint='task_details', endpoint_data=tasks, mapping=mapping,
+                          add_timestamp=True, change_index=index, output_rows=rows)
+            index.close()
+            memberships = [row for table, row in rows if table == 'task_details-memberships']
+            self.assertEqual(len(memberships), expected_rows)
+
+
+if __name__ == "__main__":
+    unittest.main()
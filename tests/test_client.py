@@ -0,0 +1,304 @@
+import asyncio
+import csv
+import datetime
+import gzip
+import logging
+import os
+import tempfile
+import time
+import unittest
+
+import httpx
+
+from asana_client.client import AsanaClient, AsanaClientException
+
+
+class TestAsanaClient(unittest.TestCase):
+
+    def setUp(self):
+        self.out_dir = tempfile.TemporaryDirectory()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.client = AsanaClient(destination=self.out_dir.name, api_token='token',
+                                  section_tasks_from_memberships=True, tmp_path=self.tmp_dir.name)
+
+    def tearDown(self):
+        self.client.tmp_store.close()
+        self.out_dir.cleanup()
+        self.tmp_dir.cleanup()
+
+    def _read_table(self, name):
+        with open(os.path.join(self.out_dir.name, f'{name}.csv')) as f:
+            return list(csv.DictReader(f))
+
+    def test_section_tasks_derived_only_when_both_endpoints_fetched(self):
+        self.client.endpoints_needed = self.client.get_endpoints_needed(['projects_sections_tasks'])
+        self.assertFalse(self.client._should_derive_section_tasks())
+
+        self.client.endpoints_needed = self.client.get_endpoints_needed(['projects_sections_tasks', 'projects_tasks'])
+        self.assertTrue(self.client._should_derive_section_tasks())
+
+    def test_section_tasks_from_memberships(self):
+        tasks = [
+            {'gid': '1', 'resource_type': 'task', 'name': 'first',
+             'memberships': [{'project': {'gid': 'p1'}, 'section': {'gid': 's1'}},
+                             {'project': {'gid': 'p2'}, 'section': {'gid': 's2'}}]},
+            {'gid': '2', 'resource_type': 'task', 'name': 'second', 'memberships': []}
+        ]
+        asyncio.run(self.client._output_section_tasks_from_memberships(tasks, project_id='p1'))
+
+        rows = self._read_table('section_tasks')
+        self.assertEqual(rows, [{'id': '1', 'resource_type': 'task', 'name': 'first', 'section_id': 's1'}])
+
+    def test_time_windows_cover_interval(self):
+        start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        end = datetime.datetime(2020, 1, 5, tzinfo=datetime.timezone.utc)
+        windows = AsanaClient._generate_time_windows(start, end, 4)
+
+        self.assertEqual(len(windows), 4)
+        self.assertIsNone(windows[0][0])
+        self.assertIsNone(windows[-1][1])
+        for (_, previous_end), (next_start, _) in zip(windows, windows[1:]):
+            self.assertLess(next_start, previous_end)
+
+    def test_oversized_parent_is_split_without_duplicates(self):
+        tasks = [{'gid': str(i), 'name': f'task {i}', 'completed': False,
+                  'created_at': f'2020-01-01T00:{i // 60:02d}:{i % 60:02d}.000Z'} for i in range(250)]
+
+        async def fake_get(endpoint, params=None):
+            if endpoint.endswith('/tasks/search'):
+                after = params.get('created_at.after')
+                before = params.get('created_at.before')
+                window = [t for t in tasks if (not after or t['created_at'] > after)
+                          and (not before or t['created_at'] < before)]
+                return {'data': window[:100]}
+            offset = int(params.get('offset', 0))
+            return {'data': tasks[offset:offset + 100], 'next_page': {'offset': str(offset + 100)}}
+
+        self.client.split_page_threshold = 1
+        self.client.split_windows = 3
+        self.client._get = fake_get
+        self.client._init_tmp_folders()
+        parent = {'gid': 'p1', 'workspace_gid': 'w1', 'created_at': '2020-01-01T00:00:00.000Z'}
+        asyncio.run(self.client._get_request(endpoint_url='projects/p1/tasks', endpoint='projects_tasks',
+                                             endpoint_id='p1', parent_data=parent))
+
+        (parent_id, data), = self.client.tmp_store.iter_records('projects_tasks')
+        self.assertEqual(parent_id, 'p1')
+        self.assertEqual(sorted(int(t['gid']) for t in data), list(range(250)))
+        self.assertEqual(self.client.parent_stats['projects_tasks']['p1'][1], 3)
+
+    def test_replayed_split_requests_recorded_windows(self):
+        tasks = [{'gid': str(i), 'created_at': f'2020-01-01T00:00:{i:02d}.000Z'} for i in range(30)]
+        archive_path = os.path.join(self.tmp_dir.name, 'archive.jsonl.gz')
+        parent = {'gid': 'p1', 'workspace_gid': 'w1', 'created_at': '2020-01-01T00:00:00.000Z'}
+
+        async def fake_get_raw(endpoint, params=None, headers=None):
+            request = httpx.Request('GET', f'https://app.asana.com/api/1.0/{endpoint}')
+            if endpoint.endswith('/tasks/search'):
+                return httpx.Response(200, json={'data': tasks}, request=request)
+            return httpx.Response(200, json={'data': tasks[:1], 'next_page': {'offset': '1'}}, request=request)
+
+        def fetch(mode):
+            client = AsanaClient(destination=self.out_dir.name, api_token='token', tmp_path=self.tmp_dir.name,
+                                 split_page_threshold=1, split_windows=3, http_archive_path=archive_path,
+                                 http_archive_mode=mode)
+            client.get_raw = fake_get_raw
+            client._init_tmp_folders()
+            asyncio.run(client._get_request(endpoint_url='projects/p1/tasks', endpoint='projects_tasks',
+                                            endpoint_id='p1', parent_data=parent))
+            client.http_archive.close()
+            (_, data), = client.tmp_store.iter_records('projects_tasks')
+            client.tmp_store.close()
+            return data
+
+        recorded = fetch('record')
+        time.sleep(0.01)
+        self.assertEqual(fetch('replay'), recorded)
+
+    def test_failed_recording_closes_archive(self):
+        archive_path = os.path.join(self.tmp_dir.name, 'archive.jsonl.gz')
+        client = AsanaClient(destination=self.out_dir.name, api_token='token', tmp_path=self.tmp_dir.name,
+                             http_archive_path=archive_path, http_archive_mode='record')
+
+        async def failing_get_raw(endpoint, params=None, headers=None):
+            request = httpx.Request('GET', f'https://app.asana.com/api/1.0/{endpoint}')
+            return httpx.Response(404, request=request)
+
+        client.get_raw = failing_get_raw
+        with self.assertRaises(AsanaClientException):
+            asyncio.run(client.fetch(['projects']))
+        client.tmp_store.close()
+
+        self.assertIsNone(client.http_archive._file)
+        with gzip.open(archive_path, 'rt') as f:
+            self.assertEqual(len([line for line in f if '"metadata"' not in line]), 1)
+
+    def test_replay_uses_recorded_completed_since(self):
+        archive_path = os.path.join(self.tmp_dir.name, 'archive.jsonl.gz')
+        requested = []
+
+        async def fake_get_raw(endpoint, params=None, headers=None):
+            requested.append((endpoint, (params or {}).get('completed_since')))
+            request = httpx.Request('GET', f'https://app.asana.com/api/1.0/{endpoint}')
+            return httpx.Response(200, json={'data': [{'gid': '1', 'name': endpoint}]}, request=request)
+
+        def stream(mode, completed_since):
+            client = AsanaClient(destination=self.out_dir.name, api_token='token', tmp_path=self.tmp_dir.name,
+                                 incremental=True, http_archive_path=archive_path, http_archive_mode=mode)
+            client.get_raw = fake_get_raw
+
+            async def collect():
+                return [record async for record in client.iter_records('projects_tasks', raw=True,
+                                                                       completed_since=completed_since)]
+            try:
+                return asyncio.run(collect())
+            finally:
+                client.http_archive.close()
+
+        recorded = stream('record', '2026-10-18T00:00:00Z')
+        self.assertIn(('projects/1/tasks', '2026-10-18T00:00:00Z'), requested)
+        self.assertEqual(stream('replay', '2026-10-19T00:00:00Z'), recorded)
+
+    def test_failed_split_stops_other_windows(self):
+        requested = []
+
+        async def fake_get(endpoint, params=None):
+            requested.append(endpoint)
+            if endpoint.endswith('/tasks/search'):
+                if not params.get('created_at.before'):
+                    raise AsanaClientException('Search not available', status_code=402)
+                await asyncio.sleep(0.01)
+                page = len(requested)
+                return {'data': [{'gid': f'{page}-{i}', 'created_at': f'2020-01-01T{page:02d}:00:{i % 60:02d}.000Z'}
+                                 for i in range(100)]}
+            offset = int(params.get('offset', 0))
+            return {'data': [{'gid': f't{offset}'}], 'next_page': {'offset': str(offset + 1)} if offset < 2 else None}
+
+        self.client.split_page_threshold = 1
+        self.client.split_windows = 3
+        self.client.previous_parent_stats = {'projects_tasks': {'p1': [5, 5]}}
+        self.client._get = fake_get
+        self.client._init_tmp_folders()
+        parent = {'gid': 'p1', 'workspace_gid': 'w1', 'created_at': '2020-01-01T00:00:00.000Z'}
+
+        async def fetch_and_wait():
+            await self.client._get_request(endpoint_url='projects/p1/tasks', endpoint='projects_tasks',
+                                           endpoint_id='p1', parent_data=parent)
+            requests_done = len(requested)
+            await asyncio.sleep(0.05)
+            return requests_done
+
+        self.assertEqual(asyncio.run(fetch_and_wait()), len(requested))
+        self.assertEqual(self.client.split_page_threshold, 0)
+
+    def test_pooled_retries_go_through_token_limiters(self):
+        client = AsanaClient(destination=self.out_dir.name, api_token='a', additional_tokens=['b'],
+                             max_requests_per_second=1000, tmp_path=self.tmp_dir.name)
+        client.backoff_factor = 0
+        statuses = [500, 503, 200]
+        sent_with = []
+
+        async def fake_get_raw(endpoint, params=None, headers=None):
+            sent_with.append(headers['Authorization'])
+            request = httpx.Request('GET', f'https://app.asana.com/api/1.0/{endpoint}')
+            return httpx.Response(statuses.pop(0), json={'data': []}, request=request)
+
+        client.get_raw = fake_get_raw
+        self.assertEqual(asyncio.run(client._get('workspaces')), {'data': []})
+
+        self.assertEqual(client.retries, 0)
+        self.assertEqual(len(sent_with), 3)
+        self.assertEqual(sum(token.requests for token in client.token_pool.tokens), 3)
+        client.tmp_store.close()
+
+    def _fetch_tasks_of_projects(self, previous_stats):
+        self.client.batch_size = 2
+        self.client.previous_parent_stats = {'projects_tasks': previous_stats}
+        self.client.parent_stats = {'projects_tasks': dict(previous_stats)}
+        self.client.root_endpoints_data['projects_details'] = [{'gid': str(i)} for i in range(5)]
+
+        async def fake_get(endpoint, params=None):
+            await asyncio.sleep(0)
+            pages = 6 if endpoint == 'projects/4/tasks' else 1
+            offset = int(params.get('offset', 0))
+            return {'data': [{'gid': f'{endpoint}-{offset}'}],
+                    'next_page': {'offset': str(offset + 1)} if offset + 1 < pages else None}
+
+        self.client._get = fake_get
+        self.client._init_tmp_folders()
+        with self.assertLogs(level='DEBUG') as logs:
+            logging.debug('fetching')
+            asyncio.run(self.client._get_multiple_batched('projects_tasks', {}, 'projects_details'))
+        return [message for message in logs.output if 'largest first' in message]
+
+    def test_schedule_report_only_when_stats_reorder_parents(self):
+        self.assertEqual(self._fetch_tasks_of_projects({}), [])
+        self.assertEqual(self.client.parent_stats['projects_tasks'], {'4': [6, 6]})
+
+        self.assertEqual(len(self._fetch_tasks_of_projects({'4': [6, 6]})), 1)
+
+    def test_stats_of_removed_parents_are_dropped(self):
+        self._fetch_tasks_of_projects({'4': [6, 6], 'removed': [3, 3]})
+        self.assertEqual(self.client.parent_stats['projects_tasks'], {'4': [6, 6]})
+
+    def _fetch_tasks_of_watermarked_projects(self, incremental):
+        self.client.incremental = incremental
+        self.client.skip_unchanged_projects = True
+        self.client.previous_project_watermarks = {
+            'endpoints': ['projects', 'projects_details', 'projects_tasks', 'workspaces'],
+            'modified_at': {'p1': '2020-01-02T00:00:00.000Z', 'p2': '2020-01-02T00:00:00.000Z'}}
+        self.client.endpoints_needed = self.client.get_endpoints_needed(['projects_tasks'])
+        self.client.prune_unchanged_projects = self.client._can_prune_unchanged_projects()
+        self.client._save_parent_endpoint_data([{'gid': 'p1', 'modified_at': '2020-01-02T00:00:00.000Z'},
+                                                {'gid': 'p2', 'modified_at': '2020-01-03T00:00:00.000Z'}],
+                                               'projects_details')
+
+        requested = []
+
+        async def fake_get(endpoint, params=None):
+            requested.append(endpoint)
+            return {'data': []}
+
+        self.client._get = fake_get
+        self.client._init_tmp_folders()
+        asyncio.run(self.client._get_multiple_batched('projects_tasks', {}, 'projects_details'))
+        return requested
+
+    def test_unchanged_projects_are_skipped(self):
+        requested = self._fetch_tasks_of_watermarked_projects(incremental=True)
+
+        self.assertEqual(requested, ['projects/p2/tasks'])
+        self.assertIn('projects_tasks', self.client.partial_endpoints)
+        self.assertEqual(self.client.get_project_watermarks()['modified_at']['p2'], '2020-01-03T00:00:00.000Z')
+
+    def test_full_load_never_skips_unchanged_projects(self):
+        requested = self._fetch_tasks_of_watermarked_projects(incremental=False)
+
+        self.assertEqual(sorted(requested), ['projects/p1/tasks', 'projects/p2/tasks'])
+        self.assertNotIn('projects_tasks', self.client.partial_endpoints)
+
+    def test_iter_records_streams_without_tmp_and_output(self):
+        responses = {
+            'workspaces': {'data': [{'gid': 'w1', 'name': 'Workspace'}]},
+            'workspaces/w1/projects': {'data': [{'gid': 'p1', 'name': 'First'}], 'next_page': {'offset': 'o1'}},
+            'workspaces/w1/projects?o1': {'data': [{'gid': 'p2', 'name': 'Second'}]}
+        }
+
+        async def fake_get(endpoint, params=None):
+            return responses[f"{endpoint}?{params['offset']}" if params.get('offset') else endpoint]
+
+        async def collect(raw):
+            return [record async for record in self.client.iter_records('projects', raw=raw, buffer_size=1)]
+
+        self.client._get = fake_get
+        self.assertEqual([record['gid'] for record in asyncio.run(collect(raw=True))], ['p1', 'p2'])
+
+        rows = asyncio.run(collect(raw=False))
+        self.assertEqual([(table, row['id'], row['workspace_id']) for table, row in rows],
+                         [('projects', 'p1', 'w1'), ('projects', 'p2', 'w1')])
+        self.assertEqual(os.listdir(self.out_dir.name), [])
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
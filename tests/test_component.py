@@ -3,12 +3,16 @@ Created on 12. 11. 2018
 
 @author: esner
 '''
+import gzip
+import json
+import os
+import tempfile
 import unittest
+
 import mock
-import os
 from freezegun import freeze_time
 
-from component import Component
+from component import Component, CHANGE_INDEX_FILE_NAME
 
 
 class TestComponent(unittest.TestCase):
@@ -23,6 +27,65 @@ class TestComponent(unittest.TestCase):
             comp.run()
 
 
+class TestChangeIndexFile(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.data_dir.name, 'in', 'files'))
+        with open(os.path.join(self.data_dir.name, 'config.json'), 'w') as f:
+            json.dump({'parameters': {'#token': 'token', 'incremental_load': True, 'endpoints': {}}}, f)
+
+    def tearDown(self):
+        self.data_dir.cleanup()
+
+    def _component(self, state):
+        with open(os.path.join(self.data_dir.name, 'in', 'state.json'), 'w') as f:
+            json.dump(state, f)
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': self.data_dir.name, 'KBC_CONFIGID': '123'}):
+            return Component()
+
+    def test_new_index_without_stored_one(self):
+        path = self._component({}).load_change_index()
+        self.assertEqual(path, os.path.join(self.data_dir.name, 'out', 'files', CHANGE_INDEX_FILE_NAME))
+        self.assertFalse(os.path.exists(path))
+
+    def test_missing_stored_index_is_rebuilt(self):
+        component = self._component({'change_index': True})
+        with self.assertLogs(level='WARNING'):
+            path = component.load_change_index()
+        self.assertFalse(os.path.exists(path))
+
+    def test_stored_index_is_loaded(self):
+        stored_path = os.path.join(self.data_dir.name, 'in', 'files', f'1_{CHANGE_INDEX_FILE_NAME}')
+        with open(stored_path, 'w') as f:
+            f.write('index')
+        with open(f'{stored_path}.manifest', 'w') as f:
+            json.dump({'id': 1, 'name': CHANGE_INDEX_FILE_NAME, 'created': '2024-01-01T00:00:00+0000',
+                       'tags': ['asana-change-index', 'asana-change-index-123']}, f)
+
+        with open(self._component({'change_index': True}).load_change_index()) as f:
+            self.assertEqual(f.read(), 'index')
+
+
+    def test_replay_keeps_state_and_index(self):
+        archive_path = os.path.join(self.data_dir.name, 'in', 'files', 'archive.jsonl.gz')
+        gzip.open(archive_path, 'wt').close()
+        state = {'last_run': '2024-01-01T00:00:00Z', 'change_index': True}
+        with open(os.path.join(self.data_dir.name, 'config.json'), 'w') as f:
+            json.dump({'parameters': {'#token': 'token', 'incremental_load': True, 'change_index': True,
+                                      'endpoints': {'workspaces': True, 'user_defined_projects': False},
+                                      'http_archive_path': archive_path,
+                                      'http_archive_mode': 'replay'}}, f)
+
+        component = self._component(state)
+        with mock.patch('component.AsanaClient.fetch', new=mock.AsyncMock()):
+            component.run()
+
+        with open(os.path.join(self.data_dir.name, 'out', 'state.json')) as f:
+            self.assertEqual(json.load(f), state)
+        self.assertFalse(os.path.exists(os.path.join(self.data_dir.name, 'out', 'files', CHANGE_INDEX_FILE_NAME)))
+
+
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
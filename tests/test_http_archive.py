@@ -0,0 +1,63 @@
+import asyncio
+import gzip
+import os
+import tempfile
+import unittest
+
+from asana_client.http_archive import HttpArchive, HttpArchiveException, MODE_RECORD, MODE_REPLAY
+
+
+class TestHttpArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'archive.jsonl.gz')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_recorded_responses_are_replayed(self):
+        archive = HttpArchive(self.path, MODE_RECORD)
+        archive.record('workspaces', {'limit': 100}, 200, {'data': [{'gid': '1'}]})
+        archive.record('projects/1', {'limit': 100}, 403)
+        archive.close()
+
+        archive = HttpArchive(self.path, MODE_REPLAY)
+        self.assertEqual(asyncio.run(archive.replay('workspaces', {'limit': '100'})), (200, {'data': [{'gid': '1'}]}))
+        self.assertEqual(asyncio.run(archive.replay('projects/1', {'limit': 100})), (403, None))
+        with self.assertRaises(HttpArchiveException):
+            asyncio.run(archive.replay('projects/2', {}))
+
+    def test_metadata_is_replayed(self):
+        archive = HttpArchive(self.path, MODE_RECORD)
+        archive.record_metadata('split_reference_time', '2020-01-01T00:00:00.000Z')
+        archive.close()
+
+        archive = HttpArchive(self.path, MODE_REPLAY)
+        self.assertEqual(archive.metadata, {'split_reference_time': '2020-01-01T00:00:00.000Z'})
+
+    def test_truncated_archive_replays_complete_entries(self):
+        archive = HttpArchive(self.path, MODE_RECORD)
+        archive.record('workspaces', {}, 200, {'data': [{'gid': '1'}]})
+        archive.record('projects/1', {}, 200, {'data': [{'gid': '2', 'name': 'x' * 1000}]})
+        archive.close()
+        with open(self.path, 'rb') as f:
+            content = f.read()
+        with open(self.path, 'wb') as f:
+            f.write(content[:-30])
+
+        archive = HttpArchive(self.path, MODE_REPLAY)
+        self.assertEqual(asyncio.run(archive.replay('workspaces', {})), (200, {'data': [{'gid': '1'}]}))
+        with self.assertRaises(HttpArchiveException):
+            asyncio.run(archive.replay('projects/1', {}))
+
+    def test_unclosed_recording_is_readable(self):
+        with gzip.open(self.path, 'wt', encoding='utf-8') as f:
+            f.write('{"key":"workspaces?{}","status_code":200,"body":{"data":[]}}\n{"key":"proj')
+
+        archive = HttpArchive(self.path, MODE_REPLAY)
+        self.assertEqual(asyncio.run(archive.replay('workspaces', {})), (200, {'data': []}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+
+from asana_client.mapping_selection import mapping_opt_fields, select_mappings
+
+MAPPINGS = {
+    'task_details': {
+        'gid': {'mapping': {'destination': 'id', 'primaryKey': True}},
+        'name': {'type': 'column', 'mapping': {'destination': 'name'}},
+        'notes': {'type': 'column', 'mapping': {'destination': 'notes'}},
+        'assignee.gid': {'type': 'column', 'mapping': {'destination': 'assignee_id'}},
+        'parent_gid': {'type': 'user', 'mapping': {'destination': 'project_id'}},
+        'tags': {'type': 'table', 'destination': 'task_details-tags', 'tableMapping': {
+            'gid': {'mapping': {'destination': 'id', 'primaryKey': True}},
+            'name': {'type': 'column', 'mapping': {'destination': 'name'}}
+        }},
+        'memberships': {'type': 'table', 'destination': 'task_details-memberships', 'tableMapping': {
+            'section.gid': {'type': 'column', 'mapping': {'destination': 'section_id'}}
+        }}
+    }
+}
+
+
+class TestMappingSelection(unittest.TestCase):
+
+    def test_no_selection_keeps_mappings(self):
+        self.assertEqual(select_mappings(MAPPINGS), MAPPINGS)
+
+    def test_columns_and_tables_selected(self):
+        selected = select_mappings(MAPPINGS, column_selection={'task_details': ['assignee_id']},
+                                   skip_tables=['task_details-memberships'])
+        self.assertEqual(list(selected['task_details']), ['gid', 'assignee.gid', 'parent_gid', 'tags'])
+        self.assertIn('memberships', MAPPINGS['task_details'])
+
+    def test_opt_fields(self):
+        selected = select_mappings(MAPPINGS, column_selection={'task_details': ['name'], 'task_details-tags': []},
+                                   skip_tables=['task_details-memberships'])
+        self.assertEqual(mapping_opt_fields(selected['task_details']), ['gid', 'name', 'tags.gid'])
+
+    def test_unknown_table_warns(self):
+        with self.assertLogs(level='WARNING'):
+            select_mappings(MAPPINGS, skip_tables=['unknown'])
+
+    def test_unknown_column_warns(self):
+        with self.assertLogs(level='WARNING') as logs:
+            selected = select_mappings(MAPPINGS, column_selection={'task_details': ['name', 'unknown']})
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('unknown', logs.output[0])
+        self.assertIn('name', selected['task_details'])
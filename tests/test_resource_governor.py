@@ -0,0 +1,102 @@
+import asyncio
+import unittest
+
+from asana_client.resource_governor import ResourceGovernor, MB
+
+
+class TestResourceGovernor(unittest.TestCase):
+
+    def test_no_budgets_never_throttle(self):
+        governor = ResourceGovernor()
+        drained = []
+
+        async def drain():
+            drained.append(True)
+
+        self.assertFalse(asyncio.run(governor.throttle(10 * MB, 100, drain)))
+        self.assertEqual(drained, [])
+
+    def test_tmp_disk_budget_drains(self):
+        governor = ResourceGovernor(max_tmp_disk_mb=1)
+        drained = []
+
+        async def drain():
+            drained.append(True)
+
+        self.assertTrue(asyncio.run(governor.throttle(2 * MB, 100, drain)))
+        self.assertEqual(drained, [True])
+        self.assertEqual(governor.throttle_count, 1)
+        self.assertEqual(governor.limit_batch_size(100), 100)
+
+    def test_memory_budget_halves_batch(self):
+        governor = ResourceGovernor(max_memory_mb=1)
+        drained = []
+
+        async def drain():
+            drained.append(True)
+
+        asyncio.run(governor.throttle(0, 100, drain))
+        self.assertEqual(governor.limit_batch_size(100), 50)
+        self.assertEqual(drained, [])
+
+        # memory is not checked again within the interval
+        self.assertFalse(asyncio.run(governor.throttle(0, 100, drain)))
+        self.assertEqual(governor.limit_batch_size(100), 50)
+
+    def test_memory_limit_lowered_only_while_growing_and_restored(self):
+        governor = ResourceGovernor(max_memory_mb=100, check_interval=0)
+        memory = [150]
+        governor.current_memory_mb = lambda: memory[0]
+
+        async def drain():
+            pass
+
+        def throttle():
+            asyncio.run(governor.throttle(0, 100, drain))
+            return governor.limit_batch_size(100)
+
+        self.assertEqual(throttle(), 50)
+        self.assertEqual(throttle(), 50)
+        memory[0] = 160
+        self.assertEqual(throttle(), 25)
+        memory[0] = 90
+        self.assertEqual(throttle(), 25)
+        memory[0] = 70
+        self.assertEqual(throttle(), 50)
+        self.assertEqual(throttle(), 100)
+        self.assertIsNone(governor.batch_limit)
+
+    def _max_in_flight(self, governor, endpoints, batch_size):
+        in_flight = [0]
+        current = [0]
+
+        async def fetch(endpoint):
+            async with governor.fetch_slot(endpoint, batch_size):
+                current[0] += 1
+                in_flight[0] = max(in_flight[0], current[0])
+                await asyncio.sleep(0.01)
+                current[0] -= 1
+
+        async def fetch_all():
+            await asyncio.gather(*[fetch(endpoint) for endpoint in endpoints for _ in range(6)])
+
+        asyncio.run(fetch_all())
+        return in_flight[0]
+
+    def test_fetch_slots_follow_the_limit_per_endpoint(self):
+        governor = ResourceGovernor(max_memory_mb=1)
+        governor.batch_limit = 2
+
+        self.assertEqual(self._max_in_flight(governor, ['stories', 'subtasks'], 10), 4)
+        self.assertGreater(governor.throttled_seconds, 0)
+
+    def test_fetch_slots_without_memory_budget_do_not_wait(self):
+        governor = ResourceGovernor()
+        governor.batch_limit = 2
+
+        self.assertEqual(self._max_in_flight(governor, ['stories', 'subtasks'], 10), 12)
+        self.assertEqual(governor.throttled_seconds, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,19 @@
+import unittest
+
+from asana_client.scheduling import estimate_makespan, order_largest_first
+
+
+class TestScheduling(unittest.TestCase):
+
+    def test_order_largest_first_keeps_order_on_ties(self):
+        self.assertEqual(order_largest_first(['a', 'b', 'c', 'd'], [1, 5, 1, 3]), ['b', 'd', 'a', 'c'])
+
+    def test_largest_first_shortens_makespan(self):
+        costs = [1, 1, 1, 1, 4]
+        self.assertEqual(estimate_makespan(costs, 2), 6)
+        self.assertEqual(estimate_makespan(sorted(costs, reverse=True), 2), 4)
+        self.assertEqual(estimate_makespan([], 2), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+
+from asana_client.segment_store import SegmentStore, INDEX_FILE_NAME
+
+
+class TestSegmentStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = SegmentStore(self.tmp_dir.name, max_segment_size=64)
+        self.store.reset('tasks')
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp_dir.cleanup()
+
+    def test_records_are_read_in_order_across_segments(self):
+        records = [(str(i), [{'gid': str(i), 'name': f'task {i}'}]) for i in range(5)]
+        for parent_id, data in records:
+            self.store.write('tasks', parent_id, data)
+
+        self.assertEqual(list(self.store.iter_records('tasks')), records)
+        segments = [f for f in os.listdir(os.path.join(self.tmp_dir.name, 'tasks')) if f != INDEX_FILE_NAME]
+        self.assertGreater(len(segments), 1)
+
+    def test_index_is_rebuilt_by_another_store(self):
+        records = [(str(i), [{'gid': str(i)}]) for i in range(5)]
+        for parent_id, data in records:
+            self.store.write('tasks', parent_id, data)
+        self.store.close()
+
+        store = SegmentStore(self.tmp_dir.name, max_segment_size=64)
+        self.assertEqual(list(store.iter_records('tasks')), records)
+        self.assertEqual(store.size('tasks'), self.store.size('tasks'))
+
+        store.write('tasks', '5', [{'gid': '5'}])
+        self.assertEqual(list(store.iter_records('tasks')), records + [('5', [{'gid': '5'}])])
+        store.close()
+
+    def test_reset_removes_data(self):
+        self.store.write('tasks', '1', [{'gid': '1'}])
+        self.store.reset('tasks')
+
+        self.assertEqual(list(self.store.iter_records('tasks')), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
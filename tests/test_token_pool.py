@@ -0,0 +1,27 @@
+import asyncio
+import unittest
+
+from asana_client.token_pool import TokenPool
+
+
+class TestTokenPool(unittest.TestCase):
+
+    def test_requests_are_spread_across_tokens(self):
+        pool = TokenPool(['a', 'b', 'c'])
+
+        async def acquire_many():
+            return [(await pool.acquire()).index for _ in range(6)]
+
+        self.assertEqual(sorted(asyncio.run(acquire_many())), [0, 0, 1, 1, 2, 2])
+
+    def test_throttled_and_excluded_tokens_are_skipped(self):
+        pool = TokenPool(['a', 'b', 'c'])
+        pool.tokens[0].throttle(60)
+
+        token = asyncio.run(pool.acquire(excluded={1}))
+        self.assertEqual(token.index, 2)
+        self.assertIsNone(asyncio.run(pool.acquire(excluded={0, 1, 2})))
+
+
+if __name__ == "__main__":
+    unittest.main()